@@ -1,14 +1,23 @@
 import csv
+import math
 import re
 import datetime
 import copy
 import os
 import ast
 
+from array import array
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor
 from functools import reduce
+from itertools import islice, repeat
 
+from homeplotter.calendarcube import CalendarCube
 from homeplotter.categorizer import Categorizer
-from homeplotter.timeseries import TimeSeries
+from homeplotter.lrucache import LRUCache
+from homeplotter.columnstore import ColumnStore, bitmap_from_indices, bitmap_indices
+from homeplotter.ledgerfile import is_ledger_file, read_ledger, write_ledger
+from homeplotter.timeseries import PERIODS, TimeSeries, complete_periods
 
 def process_date(date_string):
     if(date_string == "Reserverat"):
@@ -20,6 +29,35 @@ def process_date(date_string):
     else:
         return datetime.datetime.strptime(date_string,"%Y.%m.%d").date()
 
+def get_date_parser(date_strings):
+    #Returns a function that parses dates in the same format as the first proper date in date_strings.
+    #Detecting the format once is faster than checking it for every date as process_date does.
+    sample = next((date_string for date_string in date_strings if date_string != "Reserverat"),None)
+    if sample is None:
+        return process_date
+    separator = "-" if "-" in sample else "/" if "/" in sample else "."
+    today = datetime.date.today()
+    def parse_date(date_string):
+        if date_string == "Reserverat":
+            return today
+        try:
+            return datetime.date.fromisoformat(date_string if separator == "-" else date_string.replace(separator,"-"))
+        except ValueError:
+            #Fall back to the slower parser for dates that aren't zero padded or in another format
+            return process_date(date_string)
+    return parse_date
+
+def _read_account(account_spec,tag_file,tag_cache_dir=None,compiled_tags=False):
+    #Reads one account for AccountData.from_files, this is run in a worker process
+    (account_file,account_name,scale) = account_spec
+    account = AccountData(account_file,tag_file,account_name=account_name,tag_cache_dir=tag_cache_dir,compiled_tags=compiled_tags)
+    if account._tagged_by == "file":
+        #Saved files keep their tags when read, make sure that all accounts are tagged with the same rules
+        account._retag()
+    if scale != 1:
+        account = account/(1/scale)
+    return (account._scaled_store(),account._scales)
+
 def process_amount(amount_string):
     #Replace the decimal comma with a dot
     processed_string = amount_string.replace(",",".")
@@ -36,32 +74,71 @@ class AccountData():
         self.column_types = {0:datetime.date,1:float,2:str,3:list,4:float,5:str}
         self._daterange = []
         self._f_daterange = []
+        #Order in which pending filters are evaluated. Cheap and selective columns go first.
+        self._filter_order = {"date":0,"amount":1,"amount_unscaled":1,"account":2,"text":3,"tags":4}
+        #Saved filters from push_filter
+        self._f_stack = []
+        #Number of worker processes used when tagging, None tags in this process
+        self._tag_processes = kwds.get('tag_processes',None)
+        #Amounts are divided by this when read, so that division can share the store (see __truediv__)
+        self._divisor = 1
+        #Version of the tagger (see _tagger_version) that the tags were set with, or "file" if they were read or given
+        self._tagged_by = "file"
+        #Cache of evaluated filters, keyed by the filters applied since reset_filter
+        self._f_cache = LRUCache(kwds.get('filter_cache_size',128))
+        #Cumulative daily sums for totals and averages, keyed by the filters other than date ranges (see _range_total).
+        #Filters that were only queried once map to False.
+        self._cube_cache = LRUCache(kwds.get('cube_cache_size',32))
         
         if expense_data is None:
-            self._expenses = []
+            self._store = ColumnStore()
             #Get account name from file path or account_name parameter.
             self._scales = {kwds.get('account_name',os.path.basename(account_file).split('.')[0]):1}
         else:
-            self._expenses = expense_data
+            #Expense data can either be given as a list of rows or as an already encoded ColumnStore
+            self._store = expense_data if isinstance(expense_data,ColumnStore) else ColumnStore.from_rows(expense_data)
             #Need to set scales otherwise we don't know how different data is scaled.
             if scales is None:
                 raise ValueError("Expense data is set but not scales")
             self._scales = scales
 
         if tag_file is not None:
-            self.tagger = Categorizer(tag_file)
+            #Tags can be saved in tag_cache_dir, so that they don't need to be matched again the next time.
+            #With compiled_tags, the compiled rules are saved next to the tag file and loaded from there while it is unchanged.
+            self.tagger = Categorizer(tag_file,cache_dir=kwds.get('tag_cache_dir',None),compiled_cache=kwds.get('compiled_tags',False))
             
-        if account_file is not None:
+        if account_file is not None and is_ledger_file(account_file):
+            #Binary files saved by save(file_format="binary") contain the encoded columns and the scales
+            #With memory_map, the columns are views into the file instead of being read into memory
+            (self._store,self._scales) = read_ledger(account_file,kwds.get('memory_map',False))
+        elif account_file is not None:
             account_name=kwds.get('account_name',os.path.basename(account_file).split('.')[0])   
             self._account_reader(account_file,account_name)
         
         self._sort_dates()
         #After sorting, we can get the first and last date
-        self._daterange=[self._expenses[0][0],self._expenses[-1][0]]
+        self._daterange=[self._store.get_date(0),self._store.get_date(-1)]
         self.reset_filter()
 
+    #Rows of the whole ledger, materialized from the column store
+    @property
+    def _expenses(self):
+        return self._rows(range(len(self._store)))
+
     def get_data(self):
-        return list(self._f_expenses)
+        return self._rows(self._get_index())
+
+    def _rows(self,index):
+        rows = self._store.rows(index)
+        if self._divisor != 1:
+            amount_col = self.columns["amount"]
+            for row in rows:
+                row[amount_col] = row[amount_col]/self._divisor
+        return rows
+
+    #Returns the store with the divisor applied to the amounts
+    def _scaled_store(self):
+        return self._store.scaled(self._divisor) if self._divisor != 1 else self._store
 
     def filter_data(self,column,operator,value):
         #Dict which defines which values are accepted for different column types
@@ -82,50 +159,62 @@ class AccountData():
         else:
             raise ValueError("Unsuported column \"{column}\".".format(column=column))
 
-        if operator == "==" and col_type != list:
-            filter_fun = lambda data:data[col_i] == value
+        #Filter functions take a row index and look up the value in the column store.
+        #Tag filters are instead given as mask functions, which return a bitmap of the matching rows from the tag index.
+        get = self._column_getter(column)
+        #Dates are stored as ordinals in the column store
+        cmp_value = value.toordinal() if column == "date" else value
+        filter_fun = None
+        filter_mask = None
+        filter_range = None
+        if column == "date" and operator in ["==",">=",">","<","<="]:
+            #The store is sorted by date, so date filters can be answered with a binary search for a slice of rows
+            if operator == "==":
+                filter_range = lambda dates: (bisect_left(dates,cmp_value),bisect_right(dates,cmp_value))
+            elif operator == ">=":
+                filter_range = lambda dates: (bisect_left(dates,cmp_value),len(dates))
+            elif operator == ">":
+                filter_range = lambda dates: (bisect_right(dates,cmp_value),len(dates))
+            elif operator == "<":
+                filter_range = lambda dates: (0,bisect_left(dates,cmp_value))
+            elif operator == "<=":
+                filter_range = lambda dates: (0,bisect_right(dates,cmp_value))
+        elif operator == "==" and col_type != list:
+            filter_fun = lambda i:get(i) == cmp_value
         elif operator == "==" and col_type == list and val_type == str:
-            filter_fun = lambda data:value in data[col_i]
+            filter_mask = lambda store: store.tag_bitmap(value)
         elif operator == "==" and col_type == list and val_type == list:
             if len(value)>0:
-                filter_fun = lambda data: sorted(data[col_i])==sorted(value)
+                filter_mask = lambda store: store.tagset_bitmap(lambda tags: sorted(tags)==sorted(value))
             else:
-                filter_fun = lambda data: len(data[col_i])==0
+                filter_mask = lambda store: store.tagset_bitmap(lambda tags: len(tags)==0)
         elif operator in ["all", "any"] and col_type == list and val_type == list:
-            #Copy the value so that the modification done on the list doesn't affect the input
-            val_cpy = list(value)
-            exclude = []
-            for i in range(len(val_cpy)):
-                #Check if first letter is "*", then add children to exclusion list
-                if val_cpy[i][0] == "*":
-                    #Remove the asterix and add children to exclusion list
-                    val_cpy[i] = val_cpy[i][1:]
-                    exclude += self.tagger.get_tag_children(val_cpy[i])
-            #Remove any children from exclusion list that are also in the inclusion list 
-            exclude = list(filter(lambda elem: elem not in val_cpy,exclude))                 
+            (val_cpy,exclude) = self._split_exclusions(value)
+            #Any is the union of the tag bitmaps and all is the intersection, excluded tags are removed from both
+            exclude_mask = lambda store: reduce(int.__or__,(store.tag_bitmap(v) for v in exclude),0)
             if operator == "any":
-                filter_fun = lambda data: any(v in data[col_i] for v in val_cpy) and not any(v in data[col_i] for v in exclude)
+                filter_mask = lambda store: reduce(int.__or__,(store.tag_bitmap(v) for v in val_cpy),0) & ~exclude_mask(store)
             elif operator == "all":
-                filter_fun = lambda data: all(v in data[col_i] for v in val_cpy) and not any(v in data[col_i] for v in exclude)
+                filter_mask = lambda store: reduce(int.__and__,(store.tag_bitmap(v) for v in val_cpy),store.all_bitmap()) & ~exclude_mask(store)
         elif operator == "!=" and col_type != list:
-            filter_fun = lambda data:data[col_i] != value
+            filter_fun = lambda i:get(i) != cmp_value
         elif operator == "!=" and col_type == list and val_type == str:
-            filter_fun = lambda data:value not in data[col_i]
+            filter_mask = lambda store: store.all_bitmap() & ~store.tag_bitmap(value)
         elif operator == "!=" and col_type == list and val_type == list:
             if len(value)>0:
-                filter_fun = lambda data: all(d in value for d in data[col_i])
+                filter_mask = lambda store: store.tagset_bitmap(lambda tags: all(d in value for d in tags))
             else:
-                filter_fun = lambda data: len(data[col_i])!=0
+                filter_mask = lambda store: store.tagset_bitmap(lambda tags: len(tags)!=0)
         elif val_type == str or val_type == list:
             raise ValueError("Unsuported operator \"{operator}\" for string. Only == and != is supported.".format(operator=operator)) 
         elif operator == ">=":
-            filter_fun = lambda data:data[col_i] >= value
+            filter_fun = lambda i:get(i) >= cmp_value
         elif operator == ">":   
-            filter_fun = lambda data:data[col_i] > value
+            filter_fun = lambda i:get(i) > cmp_value
         elif operator == "<":
-            filter_fun = lambda data:data[col_i] < value
+            filter_fun = lambda i:get(i) < cmp_value
         elif operator == "<=":
-            filter_fun = lambda data:data[col_i] <= value
+            filter_fun = lambda i:get(i) <= cmp_value
         else:
             raise ValueError("Unsuported operator \"{operator}\". Only ==, >=, >, <, <=, any and all are supported.".format(operator=operator))
         
@@ -137,30 +226,268 @@ class AccountData():
             new_value = value if operator != "<" else value - datetime.timedelta(1)
             if new_value < self._daterange[1]:
                 self._f_daterange[1] = new_value
-        self._f_expenses=list(filter(filter_fun,self._f_expenses))
+        #Filters are not applied directly, they are evaluated together when the data is needed
+        self._f_chain.append((column,operator,tuple(sorted(value)) if val_type == list else value))
+        if filter_range is not None:
+            self._f_plan.append((self._filter_order[column],"range",filter_range))
+        elif filter_mask is not None:
+            self._f_plan.append((self._filter_order[column],"mask",filter_mask))
+        else:
+            self._f_plan.append((self._filter_order[column],"row",filter_fun))
     
+    #Splits the tags of an "any" or "all" filter into tags to include and tags to exclude.
+    #Tags starting with "*" are included, but their children are excluded unless they are included themselves.
+    def _split_exclusions(self,value):
+        #Copy the value so that the modification done on the list doesn't affect the input
+        val_cpy = list(value)
+        exclude = []
+        for i in range(len(val_cpy)):
+            #Check if first letter is "*", then add children to exclusion list
+            if val_cpy[i][0] == "*":
+                #Remove the asterix and add children to exclusion list
+                val_cpy[i] = val_cpy[i][1:]
+                exclude += self.tagger.get_tag_children(val_cpy[i])
+        #Remove any children from exclusion list that are also in the inclusion list 
+        exclude = list(filter(lambda elem: elem not in val_cpy,exclude))
+        return (val_cpy,exclude)
+
     def reset_filter(self):
-        self._f_expenses = self._expenses.copy()
+        #The unfiltered selection is every row index, a range avoids copying anything
+        self._f_index = range(len(self._store))
+        self._f_plan = []
+        self._f_chain = []
         self._f_daterange = self._daterange.copy()
 
+    #Saves the current filter so that more filters can be applied and then undone with pop_filter.
+    #The filter is evaluated before it is saved, so the filtering up to this point is only done once.
+    def push_filter(self):
+        self._f_stack.append((self._get_index(),self._f_daterange.copy(),list(self._f_chain)))
+
+    def pop_filter(self):
+        if len(self._f_stack) == 0:
+            raise ValueError("No saved filter to pop, push_filter needs to be called first.")
+        (self._f_index,self._f_daterange,self._f_chain) = self._f_stack.pop()
+        self._f_plan = []
+
+    #Returns the indices of the rows that pass the filter, as a range or a sorted array.
+    #Pending date filters narrow the selection to a slice first, tag filters are then combined as bitmaps and
+    #the remaining filters are applied in a single pass over the data, in the order given by _filter_order.
+    def _get_index(self):
+        if len(self._f_plan) > 0:
+            #The result only depends on the set of filters since reset (and the tagger for "*" exclusions),
+            #so filter chains that have been evaluated before can be taken from the cache
+            cache_key = (frozenset(self._f_chain),self._tagger_version())
+            cached_index = self._f_cache.get(cache_key)
+            if cached_index is not None:
+                self._f_index = cached_index
+                self._f_plan = []
+                return self._f_index
+            plan = sorted(self._f_plan, key=lambda plan:plan[0])
+            filter_ranges = [fun(self._store.dates) for (_,kind,fun) in plan if kind == "range"]
+            if len(filter_ranges) > 0:
+                start = max(rng[0] for rng in filter_ranges)
+                stop = min(rng[1] for rng in filter_ranges)
+                if type(self._f_index) is range:
+                    #Still a slice of the store, so keep it as a range instead of copying indices
+                    start = max(start,self._f_index.start)
+                    self._f_index = range(start,max(min(stop,self._f_index.stop),start))
+                else:
+                    #Indices are sorted, so the slice can be found with a binary search here as well
+                    self._f_index = self._f_index[bisect_left(self._f_index,start):bisect_left(self._f_index,max(stop,start))]
+            filter_masks = [fun for (_,kind,fun) in plan if kind == "mask"]
+            filter_funs = [fun for (_,kind,fun) in plan if kind == "row"]
+            if len(filter_masks) > 0:
+                mask = reduce(int.__and__,(filter_mask(self._store) for filter_mask in filter_masks))
+                mask &= bitmap_from_indices(self._f_index,len(self._store))
+                self._f_index = bitmap_indices(mask)
+            if len(filter_funs) == 1:
+                self._f_index = list(filter(filter_funs[0],self._f_index))
+            elif len(filter_funs) > 1:
+                self._f_index = [i for i in self._f_index if all(filter_fun(i) for filter_fun in filter_funs)]
+            self._f_plan = []
+            #Selections that aren't a slice are kept as packed arrays, a list of ints takes about 9 times the memory
+            if type(self._f_index) is not range:
+                self._f_index = array('i',self._f_index)
+            self._f_cache.put(cache_key,self._f_index)
+        return self._f_index
+
+    def _tagger_version(self):
+        return (id(self.tagger),self.tagger._version) if hasattr(self,"tagger") else None
+
+    #Returns hits, misses, maxsize and current size of the filter cache
+    def filter_cache_info(self):
+        return self._f_cache.info()
+
     def get_column(self, column):
-        return [row[self.columns[column]] for row in self.get_data()]
+        if column == "date":
+            return [self._store.get_date(i) for i in self._get_index()]
+        get = self._column_getter(column)
+        if column == "tags":
+            return [list(get(i)) for i in self._get_index()]
+        return [get(i) for i in self._get_index()]
+
+    #Returns a function which gives the value of column for a row index.
+    #Dates are returned as ordinals and tags as tuples, as they are stored in the column store.
+    def _column_getter(self, column):
+        store = self._store
+        if column == "date":
+            return store.dates.__getitem__
+        elif column == "amount" and self._divisor != 1:
+            return lambda i: store.amounts[i]/self._divisor
+        elif column == "amount":
+            return store.amounts.__getitem__
+        elif column == "amount_unscaled":
+            return store.amounts_unscaled.__getitem__
+        elif column == "text":
+            return lambda i: store.texts[store.text_codes[i]]
+        elif column == "account":
+            return lambda i: store.accounts[store.account_codes[i]]
+        elif column == "tags":
+            return lambda i: store.tagsets[store.tagset_codes[i]]
+        else:
+            raise ValueError("Unsuported column \"{column}\".".format(column=column))
 
     def get_timeseries(self):
         return TimeSeries(self.get_data(),daterange=self._f_daterange)
     
+    #Average total per whole day, week, month or year in the filtered date range. This gives the same result as
+    #accumulating the time series with TimeSeries.accumulate and averaging it, but the totals are taken from the cube.
     def get_average(self,unit):
-        ts = self.get_timeseries()
-        ts.accumulate(1,unit)
-        expenses = [data[1] for data in ts.data]
-        if len(expenses)>0:
-            return sum(expenses)/len(expenses)
-        else:
+        if unit not in PERIODS:
+            raise ValueError("delta_unit must be Day/Week/Month/Year")
+        (first_day,last_day) = sorted(self._f_daterange)
+        if first_day == last_day:
+            #A time series with a single day is not accumulated
+            return self.get_range_total(first_day,last_day)
+        (first,last) = complete_periods(first_day,last_day,unit)
+        period_start = PERIODS[unit][1]
+        #No whole period in the range, including ranges shorter than one unit
+        if last < first:
             return 0
+        total = self.get_range_total(period_start(first),period_start(last+1)-datetime.timedelta(1))
+        return total/(last-first+1)
+
+    #Sums the filtered data per label and unit (Day/Week/Month/Year) in one pass over the data.
+    #tag_groups maps labels to lists of tags, and a row is summed for a label if it would pass filter_data("tags","any",tags),
+    #including "*" exclusions. Returns the periods (first date of each) and a dictionary from label to the sums per period,
+    #the same as get_timeseries().accumulate(1,unit,padding) for each label after filtering by its tags.
+    def get_tag_matrix(self,tag_groups,unit="Month",padding=False):
+        if unit not in PERIODS:
+            raise ValueError("delta_unit must be Day/Week/Month/Year")
+        (period_id,period_start) = PERIODS[unit]
+        (first_day,last_day) = sorted(self._f_daterange)
+        if first_day == last_day:
+            #A time series with a single day is not accumulated
+            (first,last) = (first_day.toordinal(),first_day.toordinal())
+            (period_id,period_start) = PERIODS["Day"]
+        else:
+            (first,last) = complete_periods(first_day,last_day,unit,padding)
+            if last < period_id(first_day):
+                raise ValueError("Delta 1 {unit} larger than number of points in time series".format(unit=unit))
+        labels = list(tag_groups)
+        period_count = max(last-first+1,0)
+        sums = [[0]*period_count for _ in labels]
+        groups = [self._split_exclusions(tag_groups[label]) for label in labels]
+        #Rows share tag sets, so the labels are only matched once for each tag set
+        tagset_labels = {}
+        store = self._store
+        get_amount = self._column_getter("amount")
+        for i in self._get_index():
+            period = period_id(store.get_date(i))-first
+            if 0 <= period < period_count:
+                code = store.tagset_codes[i]
+                if code not in tagset_labels:
+                    tags = store.tagsets[code]
+                    tagset_labels[code] = [j for (j,(include,exclude)) in enumerate(groups)
+                        if any(tag in include for tag in tags) and not any(tag in exclude for tag in tags)]
+                amount = get_amount(i)
+                for j in tagset_labels[code]:
+                    sums[j][period] += amount
+        periods = [period_start(first+period) for period in range(period_count)]
+        return (periods,dict(zip(labels,sums)))
 
     def get_total(self):
-        expenses = [data[1] for data in self._f_expenses]
-        return sum(expenses)
+        if len(self._store) == 0:
+            return 0
+        return self._divide(self._range_total(*self._chain_daterange()))
+
+    #Total of the filtered data from start to end (both included), optionally only for a tag and/or an account.
+    #Totals are differences of cumulative daily sums once the same filters have been queried twice, then each range
+    #total takes constant time.
+    def get_range_total(self,start,end,tag=None,account=None):
+        if len(self._store) == 0:
+            return 0
+        extra_chain = []
+        if tag is not None:
+            extra_chain.append(("tags","==",tag))
+        if account is not None:
+            extra_chain.append(("account","==",account))
+        (chain_start,chain_end) = self._chain_daterange()
+        total = self._range_total(max(start.toordinal(),chain_start),min(end.toordinal(),chain_end),extra_chain)
+        return self._divide(total)
+
+    def _divide(self,amount):
+        return amount/self._divisor if self._divisor != 1 else amount
+
+    #Returns the first and last date ordinal allowed by the date filters since reset_filter
+    def _chain_daterange(self):
+        (start,end) = (self._store.dates[0],self._store.dates[-1])
+        for (column,operator,value) in self._f_chain:
+            if column == "date":
+                ordinal = value.toordinal()
+                if operator in ["==",">=",">"]:
+                    start = max(start,ordinal+1 if operator == ">" else ordinal)
+                if operator in ["==","<=","<"]:
+                    end = min(end,ordinal-1 if operator == "<" else ordinal)
+        return (start,end)
+
+    #Total of the rows passing the filters and extra_chain, from start to end (date ordinals, both included).
+    #The first time a set of filters is queried the rows are summed directly, since building a cube needs the whole history.
+    #If the same filters are queried again, a cube is built and used for all date ranges from then on.
+    def _range_total(self,start,end,extra_chain=[]):
+        #Date ranges are ranges in the cube (see _chain_daterange), so cubes are shared between them. Other date filters
+        #like != are part of the cube.
+        filter_chain = [entry for entry in self._f_chain if not (entry[0] == "date" and entry[1] in ["==",">=",">","<","<="])]
+        chain = filter_chain + extra_chain
+        cache_key = (frozenset(chain),self._tagger_version())
+        cube = self._cube_cache.get(cache_key)
+        if cube is None:
+            #Only remember that the filters were queried
+            self._cube_cache.put(cache_key,False)
+            return self._index_total(start,end,extra_chain)
+        if cube is False:
+            #The current rows can only be used if no date ranges were left out and no filters were added
+            cube = self._build_cube(chain,len(extra_chain) == 0 and len(filter_chain) == len(self._f_chain))
+            self._cube_cache.put(cache_key,cube)
+        return cube.total(start,end)
+
+    def _index_total(self,start,end,extra_chain):
+        if len(extra_chain) > 0:
+            self.push_filter()
+            for (column,operator,value) in extra_chain:
+                self.filter_data(column,operator,value)
+            index = self._get_index()
+            self.pop_filter()
+        else:
+            index = self._get_index()
+        #The rows and their indices are sorted by date, so the rows in the range are a slice of the index
+        dates = self._store.dates
+        (first,stop) = (bisect_left(dates,start),bisect_right(dates,end))
+        amounts = self._store.amounts
+        return math.fsum(amounts[i] for i in index[bisect_left(index,first):bisect_left(index,stop)])
+
+    def _build_cube(self,chain,current):
+        #If the chain is the current filter (no date ranges and no extra filters), its rows are already evaluated
+        if current:
+            return CalendarCube(self._store.dates,self._store.amounts,self._get_index())
+        #Apply the filters by themselves, and then go back to the current filter
+        self.push_filter()
+        self.reset_filter()
+        for (column,operator,value) in chain:
+            self.filter_data(column,operator,list(value) if type(value) is tuple else value)
+        cube = CalendarCube(self._store.dates,self._store.amounts,self._get_index())
+        self.pop_filter()
+        return cube
 
     def get_tags(self,operator=">=",level=0):
         tags = []
@@ -190,9 +517,11 @@ class AccountData():
             level_test_fun = lambda tag: tag in tag_list
         else:
             raise ValueError("Unsuported operator \"{operator}\". Only ==, >=, >, < and <= are supported.".format(operator=operator))
-        tag_column = self.columns["tags"]
-        for data in self._f_expenses:
-            for tag in data[tag_column]:
+        #Rows share tag sets, so only look at each distinct tag set once (in order of first appearance)
+        tagset_codes = self._store.tagset_codes
+        seen_codes = dict.fromkeys(tagset_codes[i] for i in self._get_index())
+        for code in seen_codes:
+            for tag in self._store.tagsets[code]:
                 if tag not in tags and level_test_fun(tag):
                     tags.append(tag)
         return tags
@@ -201,16 +530,16 @@ class AccountData():
     #Returns a dictionary with tag name or merged name, and list of tags it contains.
     def get_tags_by_average(self,avg_lim,other_suffix = "Other"):
         daterange = self._f_daterange
-        #Keep the filtered data since this function will call the filter function
-        f_expenses_org = list(self._f_expenses)
         def _rec_get_tags_by_average(tags, parent, res_tag_dict):
             merge_tags = ["*"+parent] if parent != "" else []
             for tag in tags:
-                self._f_expenses = list(f_expenses_org)
+                #Keep the filtered data since the tag filter should only be applied temporarily
+                self.push_filter()
                 self.filter_data("tags","any",[tag])
                 #Take the tag total and divide it by the time period in days dividied
                 #by the average number of days in a month (30.437 days)
                 tag_avg = abs(self.get_total()/((daterange[1]-daterange[0]).days/30.437))
+                self.pop_filter()
                 if tag_avg >= avg_lim * 2:
                     child_tags = self.tagger.get_tag_children(tag)
                     if len(child_tags) >= 2:
@@ -222,9 +551,10 @@ class AccountData():
                     res_tag_dict.update({tag:[tag]})
                 else:
                     merge_tags.append(tag)
-            self._f_expenses = list(f_expenses_org)
+            self.push_filter()
             self.filter_data("tags","any",merge_tags)
             tag_avg = abs(self.get_total()/((daterange[1]-daterange[0]).days/30.437))
+            self.pop_filter()
             if (tag_avg > avg_lim or parent == "") and len(merge_tags)>0:
                 if parent == "":
                     name = other_suffix
@@ -237,58 +567,61 @@ class AccountData():
                 merge_tags = []
             return [res_tag_dict,merge_tags]
         (result, _) = _rec_get_tags_by_average(self.get_tags("==",0), "", {})
-        self._f_expenses = list(f_expenses_org)
         return result
 
     def get_scale(self,account):
         return self._scales[account]
 
     def update(self,account_file,account_name):
+        #The new data is read into its own sorted store, which is scaled and tagged in place since nothing else uses it
         updated_account = AccountData(account_file,account_name=account_name)
-        updated_account = updated_account / (1/self.get_scale(account_name))
-        if hasattr(self,"tagger"):
-            updated_account.tagger = self.tagger
-        updated_account._retag()
+        new_store = updated_account._store.scaled(1/self.get_scale(account_name))
+        new_store = new_store.retagged(self._match_many)
+        #The ledger is changed, so a divided view needs its own copy of the amounts from here on
+        self._store = self._scaled_store()
+        self._divisor = 1
+        self._f_cache.clear()
+        self._cube_cache.clear()
         self._trim_date(updated_account._daterange[0],account_name)
-        self._expenses = self._expenses + updated_account._expenses
-        self._sort_dates()
-        #After supdated_accountorting, we can get the first and last date
-        self._daterange=[self._expenses[0][0],self._expenses[-1][0]]
+        #Both stores are sorted, so they can be merged instead of sorting everything again
+        self._store = self._store.merge(new_store)
+        #After merging, we can get the first and last date
+        self._daterange=[self._store.get_date(0),self._store.get_date(-1)]
         self.reset_filter()
 
-    def save(self,file_path):
-        with open(file_path, 'w', newline='') as csvfile:
-            writer = csv.writer(csvfile, delimiter=';',
-                                quotechar='|', quoting=csv.QUOTE_MINIMAL)
-            writer.writerow(list(self.columns.keys()))
-            for row in self._expenses:
-                writer.writerow(row)
+    def save(self,file_path,file_format="csv"):
+        if file_format == "binary":
+            write_ledger(file_path,self._scaled_store(),self._scales)
+        elif file_format == "csv":
+            with open(file_path, 'w', newline='') as csvfile:
+                writer = csv.writer(csvfile, delimiter=';',
+                                    quotechar='|', quoting=csv.QUOTE_MINIMAL)
+                writer.writerow(list(self.columns.keys()))
+                for row in self._expenses:
+                    writer.writerow(row)
+        else:
+            raise ValueError("Unsupported file format \"{file_format}\". Only csv and binary are supported.".format(file_format=file_format))
         
 
-    def _account_reader(self,account_file,account_name):
+    def _account_reader(self,account_file,account_name,chunk_size=10000):
         #Encoding is a bit weird, but got /ufeff otherwise https://stackoverflow.com/questions/53187097/how-to-read-file-in-python-withou-ufef
         with open(account_file, newline='',encoding='utf-8-sig') as csvfile:
             accountreader = csv.reader(csvfile, delimiter=';')
             #Skip the header line by first calling next
             header_row = next(accountreader)
+            #The file is read in chunks of rows, and each chunk is converted column by column
+            chunks = iter(lambda: list(islice(accountreader,chunk_size)),[])
             #Check if header_row contains all information from used columns. Then it is a saved AccountData object
             if (list(self.columns.keys()) == header_row):
-                #Copy the content:
-                for row in accountreader:
-                    #TODO: Optimze so that we don't do lookup for each row 
-                    append_row=[]
-                    for column_i in range(0,len(row)):
-                        if(self.column_types[column_i]==datetime.date):
-                            if(self.column_types[column_i]==datetime.date):
-                                append_row.append(datetime.datetime.strptime(row[column_i],"%Y-%m-%d").date())
-                            else:
-                                append_row.append(datetime.datetime.strptime(row[column_i],"%Y.%m.%d").date())
-                        elif(self.column_types[column_i]==list):
-                            append_row.append(ast.literal_eval(row[column_i]))
-                        else:
-                        #TODO: Fix.. This seems dangerous...
-                           append_row.append(self.column_types[column_i](row[column_i]))
-                    self._expenses.append(append_row)
+                #Tags are saved as list reprs. Rows often share tags so only evaluate each distinct string once.
+                tag_lookup = {}
+                def parse_tags(tag_string):
+                    if tag_string not in tag_lookup:
+                        tag_lookup[tag_string] = ast.literal_eval(tag_string)
+                    return tag_lookup[tag_string]
+                for chunk in chunks:
+                    (dates,amounts,texts,tags,amounts_unscaled,accounts) = zip(*chunk)
+                    self._store.extend(map(datetime.date.fromisoformat,dates),map(float,amounts),texts,map(parse_tags,tags),map(float,amounts_unscaled),accounts)
             #Otherwise it is a csv account file
             else:
                 #Maybe clean this up and not have multiple try except
@@ -299,48 +632,116 @@ class AccountData():
                         file_columns = {"date":header_row.index("Datum"),"amount":header_row.index("Belopp"),"text":header_row.index("Text")}
                     except ValueError:
                         raise ValueError("Unsupported csv file structure.")
-                for row in accountreader:
-                        tags=self.tagger.match(row[file_columns["text"]]) if hasattr(self,"tagger") else []
-                        self._expenses.append([process_date(row[file_columns["date"]]),process_amount(row[file_columns["amount"]]),row[file_columns["text"]],tags,process_amount(row[file_columns["amount"]]),account_name])
+                parse_date = None
+                for chunk in chunks:
+                    dates = [row[file_columns["date"]] for row in chunk]
+                    if parse_date is None:
+                        #The date format is detected once per file
+                        parse_date = get_date_parser(dates)
+                    amounts = list(map(process_amount,(row[file_columns["amount"]] for row in chunk)))
+                    texts = [row[file_columns["text"]] for row in chunk]
+                    self._store.extend(map(parse_date,dates),amounts,texts,repeat([],len(chunk)),amounts,repeat(account_name,len(chunk)))
+                #Tag all rows at once, the store only matches each distinct text once
+                if hasattr(self,"tagger"):
+                    self._store = self._store.retagged(self._match_many)
+                self._tagged_by = self._tagger_version()
+
+    #Returns the tags for each text in texts, matching is done in worker processes if tag_processes was given
+    def _match_many(self,texts):
+        if hasattr(self,"tagger"):
+            return self.tagger.match_many(texts,self._tag_processes)
+        return [[] for _ in texts]
 
     def _retag(self):
-        for row in self._expenses:
-            row[self.columns["tags"]]=self.tagger.match(row[self.columns["text"]]) if hasattr(self,"tagger") else []
+        self._f_cache.clear()
+        self._cube_cache.clear()
+        text_codes = self._changed_texts()
+        self._store = self._store.retagged(self._match_many,text_codes)
+        self._tagged_by = self._tagger_version()
+
+    #Returns the codes of the texts that can get other tags since the rows were tagged,
+    #or None if all of them have to be matched again.
+    def _changed_texts(self):
+        tagger_version = self._tagger_version()
+        if type(self._tagged_by) is not tuple or tagger_version is None or self._tagged_by[0] != tagger_version[0]:
+            return None
+        changed_tags = self.tagger.changed_tags(self._tagged_by[1])
+        if changed_tags is None:
+            return None
+        #A text is affected if it has one of the changed tags now, or if one of them matches it with the new rules
+        store = self._store
+        text_codes = []
+        for (code,text) in enumerate(store.texts):
+            tags = store.text_tags(code)
+            if tags is not None and (not changed_tags.isdisjoint(tags) or self.tagger.matches_any(text,changed_tags)):
+                text_codes.append(code)
+        return text_codes
 
     def _trim_date(self,cut_off_date,account_name):
-        trim_rows = []
-        for row in self._expenses:
-            if ((row[self.columns["account"]] == account_name) and (row[self.columns["date"]] >= cut_off_date)):
-                trim_rows.append(row)
-        for row in trim_rows:
-            self._expenses.remove(row)
+        store = self._store
+        cut_off = cut_off_date.toordinal()
+        account_code = store._account_lookup.get(account_name)
+        #Rows before the cut off date are all kept, so only the rows after it need to be checked
+        cut_off_i = bisect_left(store.dates,cut_off)
+        keep_rows = list(range(cut_off_i))
+        keep_rows += [i for i in range(cut_off_i,len(store)) if store.account_codes[i] != account_code]
+        self._store = store.take(keep_rows)
 
     #Sort date set to private, data that is returned should always be sorted
     def _sort_dates(self):
-        self._expenses=sorted(self._expenses, key = lambda l:l[0])
+        self._store=self._store.sort_dates()
 
     def __add__(self, other):
-        expense_data=self._expenses+other._expenses
-        #Merge scales dictionaries: https://stackoverflow.com/questions/38987/how-do-i-merge-two-dictionaries-in-a-single-expression-take-union-of-dictionari
-        scales = {**self._scales,**other._scales}
-        new_account = AccountData(expense_data=expense_data,scales=scales)
+        return AccountData.merge([self,other])
+
+    #Reads a list of (account_file, account_name, scale) specs into one AccountData object.
+    #The files are read and tagged in parallel in a process pool, and then merged as in merge.
+    @classmethod
+    def from_files(cls, account_specs, tag_file=None, processes=None, tag_cache_dir=None, compiled_tags=False):
+        if processes == 1 or len(account_specs) == 1:
+            results = [_read_account(account_spec,tag_file,tag_cache_dir,compiled_tags) for account_spec in account_specs]
+        else:
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                results = list(executor.map(_read_account,account_specs,repeat(tag_file),repeat(tag_cache_dir),repeat(compiled_tags)))
+        stores = [store for (store,_) in results]
+        scales = reduce(lambda scales,other_scales: {**scales,**other_scales},(scales for (_,scales) in results))
+        new_account = cls(expense_data=stores[0].merge(*stores[1:]),scales=scales)
+        if tag_file is not None:
+            #All data has been tagged with the same rules in the workers, so there is no need to retag it
+            new_account.tagger = Categorizer(tag_file,cache_dir=tag_cache_dir,compiled_cache=compiled_tags)
+        new_account._tagged_by = new_account._tagger_version()
+        return new_account
+
+    #Combines several AccountData objects into one, as if they were added together.
+    #The sorted data of every account is merged in one pass, and only data which hasn't already been
+    #tagged by the tagger of the result is retagged.
+    @classmethod
+    def merge(cls, accounts):
         #Tagger needs to be added to the new account data object so that we can get levels from it later
-        if hasattr(self,"tagger"):
-            new_account.tagger = self.tagger
-        elif hasattr(other,"tagger"):
-            new_account.tagger = other.tagger
-        new_account._retag()
+        tagger = next((account.tagger for account in accounts if hasattr(account,"tagger")),None)
+        tagger_version = (id(tagger),tagger._version) if tagger is not None else None
+        match_many = tagger.match_many if tagger is not None else lambda texts: [[] for _ in texts]
+        stores = []
+        for account in accounts:
+            store = account._scaled_store()
+            if account._tagged_by != tagger_version:
+                store = store.retagged(match_many)
+            stores.append(store)
+        #Merge scales dictionaries: https://stackoverflow.com/questions/38987/how-do-i-merge-two-dictionaries-in-a-single-expression-take-union-of-dictionari
+        scales = reduce(lambda scales,other_scales: {**scales,**other_scales},(account._scales for account in accounts))
+        new_account = cls(expense_data=stores[0].merge(*stores[1:]),scales=scales)
+        if tagger is not None:
+            new_account.tagger = tagger
+        new_account._tagged_by = tagger_version
         return new_account
 
     def __truediv__(self, divisor):
-        #Needs to deep copy, otherwise the elements in the list are the same id.
-        expense_data=copy.deepcopy(self._expenses)
+        #The new object shares the store, amounts are divided by the divisor when they are read
         scales = copy.deepcopy(self._scales)
-        amount_col = self.columns["amount"]
-        for i in range(len(expense_data)):
-            expense_data[i][amount_col]=expense_data[i][amount_col]/divisor
         scales={k: v / divisor for k, v in scales.items()}
-        new_account = AccountData(expense_data=expense_data,scales=scales)
+        new_account = AccountData(expense_data=self._store,scales=scales)
+        new_account._divisor = self._divisor*divisor
+        new_account._tagged_by = self._tagged_by
         if hasattr(self,"tagger"):
             new_account.tagger = self.tagger
         if hasattr(self,"categorizer"):
@@ -0,0 +1,27 @@
+import math
+
+from itertools import accumulate
+
+#Cumulative sums of amounts per day, so that the total of any date range is the difference of two sums.
+#The daily totals are summed with fsum. The cumulative sums are floats, so a range total can differ from summing
+#its rows by the rounding of the two sums, which is far below a cent for any realistic ledger.
+class CalendarCube():
+    def __init__(self, dates, amounts, indices):
+        #dates are date ordinals sorted in ascending order and indices are the rows to include
+        self.first = dates[0] if len(dates) > 0 else 0
+        self.days = dates[-1] - self.first + 1 if len(dates) > 0 else 0
+        day_amounts = {}
+        for i in indices:
+            day_amounts.setdefault(dates[i] - self.first, []).append(amounts[i])
+        day_sums = [0.0] * self.days
+        for (day, amounts_of_day) in day_amounts.items():
+            day_sums[day] = math.fsum(amounts_of_day)
+        self._sums = list(accumulate(day_sums, initial=0.0))
+
+    def total(self, start, stop):
+        #Total of the days from start to stop (ordinals), both included
+        start = min(max(start - self.first, 0), self.days)
+        stop = min(max(stop - self.first + 1, 0), self.days)
+        if stop <= start:
+            return 0.0
+        return self._sums[stop] - self._sums[start]
@@ -1,10 +1,67 @@
 import json
 import re
 import collections
+import hashlib
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from typing import List
 
+from homeplotter.lrucache import LRUCache
+from homeplotter.tagcache import TagCache
+
+# Remove common astrixes from reciever text since it they mess up matching and show up in random places
+replacements = ["K*", "C*", "*", "**"]
+
+def remove_replacements(text):
+    # Remove all sequences listed in replacements from the text
+    for rep in replacements:
+        text = text.replace(rep, "")
+    return text
+
+def _match_rules(r_text, any_matcher, matchers):
+    #If the combined pattern doesn't match, none of the tags will
+    if any_matcher is None or any_matcher.search(r_text) is None:
+        return []
+    matches = []
+    for (pattern, tag_chain) in matchers:
+        if pattern.search(r_text) is not None:
+            matches += tag_chain
+    return matches
+
+#Compiled rules of the worker processes in match_many, set once in each process by _init_worker
+_worker_rules = None
+
+def _init_worker(any_pattern, matchers):
+    global _worker_rules
+    any_matcher = re.compile(any_pattern) if any_pattern is not None else None
+    _worker_rules = (any_matcher, [(re.compile(pattern), tag_chain) for (pattern, tag_chain) in matchers])
+
+def _match_worker_chunk(r_texts):
+    (any_matcher, matchers) = _worker_rules
+    return [_match_rules(r_text, any_matcher, matchers) for r_text in r_texts]
+
+#Flattened rules and their patterns are saved as json in a file next to the tag file, see compiled_cache in Categorizer.
+#COMPILED_FORMAT needs to be increased when the saved attributes change.
+COMPILED_SUFFIX = ".compiled"
+COMPILED_FORMAT = 2
+
 class Categorizer():
-    def __init__(self, cfile):
+    def __init__(self, cfile, cache_size=4096, cache_dir=None, compiled_cache=False):
+        #Bank statements repeat the same texts a lot, so match results are cached on the text
+        self._match_cache = LRUCache(cache_size)
+        #If cache_dir is given, match results are also saved there for other processes using the same rules (see TagCache)
+        self._cache_dir = cache_dir
+        #Increased for every change of the rules, so that results depending on them can be invalidated
+        self._version = 0
+        #Tags that were changed by each version, as (version, tag)
+        self._changes = []
+        #If compiled_cache is set, the flattened rules are saved next to cfile and loaded from there while cfile is unchanged
+        if compiled_cache:
+            with open(cfile,"rb") as json_file:
+                json_hash = hashlib.sha1(json_file.read()).hexdigest()
+            if self._load_compiled(cfile+COMPILED_SUFFIX,json_hash):
+                return
         with open(cfile) as json_file:
             data = json.load(json_file)
             #Using ordered dict since I need to makes sure it's the last key that matches everything.
@@ -43,37 +100,208 @@ class Categorizer():
                 #Tag parents need to be extracted from _rec_cat before tag_unnesting as it flattens the levels
             self._tag_parents=parent_unnesting(self._rec_cat)
             self._rec_cat = collections.OrderedDict(tag_flattening(self._rec_cat))
-        
-    def match(self,reciever):
-        # Remove common astrixes from reciever text since it they mess up matching and show up in random places
-        replacements = ["K*", "C*", "*", "**"]
-        r_text = reciever
-        # Remove all sequences listed in replacements from the text
-        for rep in replacements:
-            r_text = r_text.replace(rep, "")
-        
-        matches = []
+        self._index_hierarchy()
+        self._compile()
+        if compiled_cache:
+            self._save_compiled(cfile+COMPILED_SUFFIX,json_hash)
+
+    def _load_compiled(self,compiled_file,json_hash):
+        #Returns False if there is no compiled file for the current json file
+        try:
+            with open(compiled_file,encoding="utf-8") as cache_file:
+                compiled = json.load(cache_file)
+        except (OSError,ValueError):
+            #Missing or unreadable, then the json file is used
+            return False
+        if compiled.get("format") != COMPILED_FORMAT or compiled.get("json_hash") != json_hash:
+            return False
+        #Json has no tuples, and keeps the order of the tags in lists
+        self._rec_cat = collections.OrderedDict(compiled["rec_cat"])
+        self._tag_parents = compiled["tag_parents"]
+        self._index_hierarchy()
+        self._set_rules([(tag,pattern,tag_chain) for (tag,pattern,tag_chain) in compiled["rules"]],compiled["any_pattern"])
+        return True
+
+    def _save_compiled(self,compiled_file,json_hash):
+        compiled = {"format":COMPILED_FORMAT,"json_hash":json_hash,"rec_cat":list(self._rec_cat.items()),
+            "tag_parents":self._tag_parents,"rules":self._rules,"any_pattern":self._any_pattern}
+        #Write to a temporary file first so that other processes never read a partly written file
+        try:
+            (fd,temp_path) = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(compiled_file)),suffix=".tmp")
+        except OSError:
+            #The cache is only an optimization, so it's fine if it can't be written
+            return
+        try:
+            with os.fdopen(fd,"w",encoding="utf-8") as temp_file:
+                json.dump(compiled,temp_file)
+            os.replace(temp_path,compiled_file)
+        except OSError:
+            os.remove(temp_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def _index_hierarchy(self):
+        #Children lists, depths and ancestors of every tag, so that hierarchy queries don't need to walk _tag_parents.
+        #They are kept up to date by append and remove. Ancestors are ordered from the parent and up.
+        self._children = {}
+        for tag in self._tag_parents:
+            self._children.setdefault(self._tag_parents[tag],[]).append(tag)
+        self._depth = {}
+        self._ancestors = {}
+        #Start from the top tags, and tags with a parent that isn't a tag itself
+        for tag in self._rec_cat:
+            if self._tag_parents.get(tag,None) not in self._rec_cat:
+                self._index_subtree(tag)
+        #Pre and post order numbers for subtree tests, rebuilt when needed after a change
+        self._intervals = None
+
+    def _index_subtree(self,tag):
+        #Sets depth and ancestors of tag from its parent, and then for all of its descendants
+        parent_tag = self._tag_parents.get(tag,None)
+        if parent_tag is None:
+            self._ancestors[tag] = ()
+        else:
+            self._ancestors[tag] = (parent_tag,) + self._ancestors.get(parent_tag,())
+        self._depth[tag] = len(self._ancestors[tag])
+        for child_tag in self._children.get(tag,[]):
+            self._index_subtree(child_tag)
+
+    def _build_intervals(self):
+        self._intervals = {}
+        counter = 0
+        def number(tag):
+            nonlocal counter
+            pre = counter
+            counter += 1
+            for child_tag in self._children.get(tag,[]):
+                number(child_tag)
+            self._intervals[tag] = (pre,counter)
+        for tag in self._rec_cat:
+            if self._tag_parents.get(tag,None) not in self._rec_cat:
+                number(tag)
+
+    def _compile(self):
+        #Build the patterns once, instead of building regular expressions for every match.
+        #Each tag gets its own pattern together with the list of tags it adds when matching (itself and its parents).
+        rules = []
+        keywords = []
         for tag in self._rec_cat:
-            reg_exp = "(?i)\\b("+"|".join(self._rec_cat[tag])+")\\b"
-            # Remove all sequences listed in replacements from the reg_exp
-            for rep in replacements:
-                reg_exp = reg_exp.replace(rep, "")
-            if self._rec_cat[tag] != [] and not re.search(reg_exp,r_text) is None:
-                matches.append(tag)
-                #Check if it has a parent, and add those recursively as well.
-                parent_tag = self._tag_parents.get(tag,None)
-                while parent_tag is not None:
-                    matches.append(parent_tag)
-                    parent_tag = self._tag_parents.get(parent_tag,None)
+            if self._rec_cat[tag] != []:
+                reg_exp = remove_replacements("(?i)\\b("+"|".join(self._rec_cat[tag])+")\\b")
+                #Add the parents as well
+                tag_chain = [tag] + list(self._ancestors[tag])
+                rules.append((tag,reg_exp,tag_chain))
+                keywords += self._rec_cat[tag]
+        #All keywords combined in one pattern. If it doesn't match, none of the tags will, so most
+        #untagged texts only need one search.
+        if len(keywords) > 0:
+            any_pattern = remove_replacements("(?i)\\b("+"|".join(keywords)+")\\b")
+        else:
+            any_pattern = None
+        self._set_rules(rules,any_pattern)
+
+    def _set_rules(self,rules,any_pattern):
+        #The patterns are only compiled when they are first needed: texts found in the tag cache don't need any of them,
+        #and the tag patterns are only needed once the combined pattern has matched.
+        self._match_cache.clear()
+        self._tag_cache = None
+        self._rules = rules
+        self._reg_exps = {tag:reg_exp for (tag,reg_exp,_) in rules}
+        self._any_pattern = any_pattern
+        self._any_matcher = None
+        self._matchers = None
+        self._tag_patterns = {}
+
+    def _tag_pattern(self,tag):
+        pattern = self._tag_patterns.get(tag)
+        if pattern is None:
+            pattern = self._tag_patterns[tag] = re.compile(self._reg_exps[tag])
+        return pattern
+
+    def match(self,reciever):
+        #Return a copy so that the cached list can't be changed by the caller
+        return list(self._cached_match(remove_replacements(reciever)))
+
+    def _cached_match(self,r_text):
+        matches = self._match_cache.get(r_text)
+        if matches is None:
+            matches = self._match(r_text)
+            self._match_cache.put(r_text,matches)
         return matches
 
-        #Throw exception?
-        return None
+    #Matches a batch of texts, each distinct text is only matched once.
+    #If processes is given, batches with more than chunk_size distinct texts are split between worker processes.
+    def match_many(self,recievers,processes=None,chunk_size=1000):
+        r_texts = [remove_replacements(reciever) for reciever in recievers]
+        text_matches = {}
+        tag_cache = self._get_tag_cache()
+        if tag_cache is not None:
+            for r_text in dict.fromkeys(r_texts):
+                matches = tag_cache.get(r_text)
+                if matches is not None:
+                    text_matches[r_text] = matches
+        distinct_texts = [r_text for r_text in dict.fromkeys(r_texts) if r_text not in text_matches]
+        if processes is not None and processes != 1 and len(distinct_texts) > chunk_size:
+            chunks = [distinct_texts[i:i+chunk_size] for i in range(0,len(distinct_texts),chunk_size)]
+            #The rules are sent once to each worker process, only the texts are sent with each chunk
+            matchers = [(reg_exp,tag_chain) for (tag,reg_exp,tag_chain) in self._rules]
+            with ProcessPoolExecutor(max_workers=processes,initializer=_init_worker,initargs=(self._any_pattern,matchers)) as executor:
+                results = [matches for chunk_matches in executor.map(_match_worker_chunk,chunks) for matches in chunk_matches]
+            for (r_text,matches) in zip(distinct_texts,results):
+                self._match_cache.put(r_text,matches)
+        else:
+            results = [self._cached_match(r_text) for r_text in distinct_texts]
+        if tag_cache is not None:
+            tag_cache.update(dict(zip(distinct_texts,results)))
+            tag_cache.save()
+        text_matches.update(zip(distinct_texts,results))
+        return [list(text_matches[r_text]) for r_text in r_texts]
+
+    def _get_tag_cache(self):
+        #Created when first needed after the rules were compiled, since the file depends on the rules
+        if self._cache_dir is not None and self._tag_cache is None:
+            rules = [[tag,reg_exp,tag_chain] for (tag,reg_exp,tag_chain) in self._rules]
+            try:
+                self._tag_cache = TagCache(self._cache_dir,rules,self._matches_any)
+            except OSError:
+                #The cache is only an optimization, match without it if cache_dir can't be used
+                self._cache_dir = None
+        return self._tag_cache
+
+    #Returns hits, misses, maxsize and current size of the match cache
+    def match_cache_info(self):
+        return self._match_cache.info()
+
+    def _match(self,r_text):
+        if self._any_pattern is None:
+            return []
+        if self._any_matcher is None:
+            self._any_matcher = re.compile(self._any_pattern)
+        if self._matchers is None:
+            #The tag patterns are compiled for the first text the combined pattern matches
+            if self._any_matcher.search(r_text) is None:
+                return []
+            self._matchers = [(self._tag_pattern(tag),tag_chain) for (tag,_,tag_chain) in self._rules]
+        return _match_rules(r_text,self._any_matcher,self._matchers)
     
+    #Returns the tags changed since version, or None if it isn't a version of these rules
+    def changed_tags(self,version):
+        if version > self._version:
+            return None
+        return {tag for (change_version,tag) in self._changes if change_version > version}
+
+    #Check if the pattern of any of the tags matches the text
+    def matches_any(self,reciever,tags):
+        return self._matches_any(remove_replacements(reciever),tags)
+
+    def _matches_any(self,r_text,tags):
+        return any(self._tag_pattern(tag).search(r_text) is not None for tag in tags if tag in self._reg_exps)
+
     def get_levels(self):
         tag_levels = {}
         for tag in self._rec_cat:
-            level = self.get_level(tag)
+            level = self._depth[tag]
             if level in tag_levels:
                 tag_levels[level].append(tag)
             else:
@@ -81,14 +309,29 @@ class Categorizer():
         return tag_levels
 
     def get_level(self,tag):
-        level = 0
-        next_tag = tag
-        while next_tag in self._tag_parents:
-            next_tag = self._tag_parents[next_tag]
-            level+=1
-        return level
+        return self._depth.get(tag,0)
+
+    def _descendants(self,tag):
+        descendants = []
+        for child_tag in self._children.get(tag,[]):
+            descendants += [child_tag] + self._descendants(child_tag)
+        return descendants
+
+    def get_ancestors(self,tag):
+        return list(self._ancestors.get(tag,()))
+
+    #Check if tag is in the subtree below ancestor, using the pre and post order numbers of the tags
+    def is_descendant(self,tag,ancestor):
+        if self._intervals is None:
+            self._build_intervals()
+        if tag not in self._intervals or ancestor not in self._intervals:
+            return False
+        (tag_pre,tag_post) = self._intervals[tag]
+        (ancestor_pre,ancestor_post) = self._intervals[ancestor]
+        return ancestor_pre < tag_pre and tag_post <= ancestor_post
 
     def append(self,tag,text,parent_tag=None):
+        self._version += 1
         #Check if tag already exists.
         if tag in self._rec_cat:
             #If it exists, append the text to the list or dict
@@ -103,37 +346,42 @@ class Categorizer():
             self._rec_cat[tag]=[text]
             if parent_tag is not None:
                 self._tag_parents[tag]=parent_tag
+                self._children.setdefault(parent_tag,[]).append(tag)
+            self._index_subtree(tag)
+            self._intervals = None
+            #Tags below a new tag get new parents when they are matched
+            self._changes += [(self._version,sub_tag) for sub_tag in self._descendants(tag)]
+        self._changes.append((self._version,tag))
+        self._compile()
 
     def remove(self,tag,reciever=None):
+        self._version += 1
         if reciever is None:
             #If reciever is None, delete the entire tag
             #First, delete any eventual children
             #Check if tag is a parent to one or more children
-            child_tags = []
-            for child_tag in self._tag_parents:
-                if self._tag_parents[child_tag] == tag:
-                    #The loop need to be evaluated before removing the child tags
-                    #Otherwise we'll get RuntimeError: dictionary changed size during iteration
-                    #Since delete modifes the _tag_parents dict. So we keep track of them in a list instead.
-                    child_tags.append(child_tag)
-            for child_tag in child_tags:
+            #Copy the list since removing a child changes it
+            for child_tag in list(self._children.get(tag,[])):
                 self.remove(child_tag)
             #Delete the tag from the reciever categories
             del self._rec_cat[tag]
             #If the tag has a parent, delete it in the parents entry as well
             if tag in self._tag_parents:
+                self._children[self._tag_parents[tag]].remove(tag)
                 del self._tag_parents[tag]
+            self._children.pop(tag,None)
+            del self._depth[tag]
+            del self._ancestors[tag]
+            self._intervals = None
         else:
             #Else, only delete the reciever from the particular tag
             self._rec_cat[tag].remove(reciever)
+        self._changes.append((self._version,tag))
+        self._compile()
 
     def save(self, cfile):
         def tag_nesting(tag):
-            #Find all child tags (keys to tag parents are children)
-            child_tags = []
-            for child_tag in self._tag_parents:
-                if self._tag_parents[child_tag] == tag:
-                    child_tags.append(child_tag)
+            child_tags = self.get_tag_children(tag)
             if child_tags != []:
                 nested_tags = {}
                 #check if it has own tags, add them as the "''" key then
@@ -153,13 +401,9 @@ class Categorizer():
         catFile.write(data)
         catFile.close()
 
-    #TODO Write test
     def get_tag_children(self,parent):
-        children = []
-        for tag in self._tag_parents:
-            if self._tag_parents[tag] == parent:
-                children.append(tag)
-        return children
+        #Return a copy so that the caller can't change the index
+        return list(self._children.get(parent,[]))
 
 if __name__=="__main__":
     categorizer = Categorizer("/root/projects/homeplotter/example_data/tags_nested.json")
@@ -0,0 +1,284 @@
+import copy
+import datetime
+import heapq
+import operator
+
+from array import array
+from itertools import accumulate, islice
+
+#Bitmaps of rows are stored as ints, where bit i is set if row i is included.
+#Set operations on the rows are then done with |, & and & ~ on whole bitmaps at once.
+def bitmap_from_indices(indices, length):
+    if type(indices) is range and indices.step == 1 and indices.start <= indices.stop:
+        return ((1 << indices.stop) - 1) ^ ((1 << indices.start) - 1)
+    bits = bytearray((length + 7) // 8)
+    for i in indices:
+        bits[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(bits, "little")
+
+def bitmap_indices(bitmap):
+    #Reverse the binary representation so that string position equals row index, then search for the set bits
+    bits = bin(bitmap)[:1:-1]
+    indices = []
+    i = bits.find("1")
+    while i != -1:
+        indices.append(i)
+        i = bits.find("1", i + 1)
+    return indices
+
+#Columnar storage of the transactions in an AccountData object.
+#Dates are stored as ordinals and amounts as doubles in packed arrays. Text, account and tag sets
+#are dictionary encoded, so that each row only stores an integer code for them.
+#The columns can also be read only memoryviews (see ledgerfile), so a store is never modified in place
+#except for append and extend which are only used on new stores. Stores may share columns with each other.
+class ColumnStore():
+    def __init__(self):
+        self.dates = array('q')
+        self.amounts = array('d')
+        self.amounts_unscaled = array('d')
+        self.text_codes = array('i')
+        self.account_codes = array('i')
+        self.tagset_codes = array('i')
+        #Dictionaries used for the encoding. Lists go from code to value, the lookups go from value to code
+        self.texts = []
+        self.accounts = []
+        self.tagsets = []
+        self._text_lookup = {}
+        self._account_lookup = {}
+        self._tagset_lookup = {}
+        #Inverted index from tag to a bitmap of rows, built when first needed
+        self._tag_index = None
+        self._tagset_bitmaps = None
+        #Rows of each text code, built when first needed
+        self._text_rows = None
+
+    @classmethod
+    def from_rows(cls, rows):
+        store = cls()
+        for row in rows:
+            store.append(*row)
+        return store
+
+    @classmethod
+    def from_columns(cls, dates, amounts, amounts_unscaled, text_codes, account_codes, tagset_codes, texts, accounts, tagsets):
+        #Create a store from already encoded columns, the lookups are rebuilt from the dictionaries
+        store = cls()
+        store.dates = dates
+        store.amounts = amounts
+        store.amounts_unscaled = amounts_unscaled
+        store.text_codes = text_codes
+        store.account_codes = account_codes
+        store.tagset_codes = tagset_codes
+        store.texts = list(texts)
+        store.accounts = list(accounts)
+        store.tagsets = [tuple(tags) for tags in tagsets]
+        store._text_lookup = {text:code for (code,text) in enumerate(store.texts)}
+        store._account_lookup = {account:code for (code,account) in enumerate(store.accounts)}
+        store._tagset_lookup = {tags:code for (code,tags) in enumerate(store.tagsets)}
+        return store
+
+    def __len__(self):
+        return len(self.dates)
+
+    def append(self, date, amount, text, tags, amount_unscaled, account):
+        self.dates.append(date.toordinal())
+        self.amounts.append(amount)
+        self.amounts_unscaled.append(amount_unscaled)
+        self.text_codes.append(self.encode_text(text))
+        self.account_codes.append(self.encode_account(account))
+        self.tagset_codes.append(self.encode_tagset(tags))
+        self._tag_index = None
+        self._text_rows = None
+
+    def extend(self, dates, amounts, texts, tags, amounts_unscaled, accounts):
+        #Appends whole columns at once, which avoids the per row overhead of append
+        self.dates.extend(date.toordinal() for date in dates)
+        self.amounts.extend(amounts)
+        self.amounts_unscaled.extend(amounts_unscaled)
+        self.text_codes.extend(map(self.encode_text, texts))
+        self.account_codes.extend(map(self.encode_account, accounts))
+        self.tagset_codes.extend(map(self.encode_tagset, tags))
+        self._tag_index = None
+        self._text_rows = None
+
+    def encode_text(self, text):
+        code = self._text_lookup.get(text)
+        if code is None:
+            code = self._text_lookup[text] = len(self.texts)
+            self.texts.append(text)
+        return code
+
+    def encode_account(self, account):
+        code = self._account_lookup.get(account)
+        if code is None:
+            code = self._account_lookup[account] = len(self.accounts)
+            self.accounts.append(account)
+        return code
+
+    def encode_tagset(self, tags):
+        #Tag sets are stored as tuples so that they can be used as dictionary keys, order is kept
+        tags = tuple(tags)
+        code = self._tagset_lookup.get(tags)
+        if code is None:
+            code = self._tagset_lookup[tags] = len(self.tagsets)
+            self.tagsets.append(tags)
+        return code
+
+    def get_date(self, i):
+        return datetime.date.fromordinal(self.dates[i])
+
+    def get_text(self, i):
+        return self.texts[self.text_codes[i]]
+
+    def get_account(self, i):
+        return self.accounts[self.account_codes[i]]
+
+    def get_tags(self, i):
+        return list(self.tagsets[self.tagset_codes[i]])
+
+    def row(self, i):
+        return [self.get_date(i),self.amounts[i],self.get_text(i),self.get_tags(i),self.amounts_unscaled[i],self.get_account(i)]
+
+    def rows(self, indices=None):
+        if indices is None:
+            indices = range(len(self))
+        return [self.row(i) for i in indices]
+
+    def take(self, indices):
+        #Create a new store containing the rows at indices, in that order.
+        #The dictionaries are copied as is, so codes stay valid in the new store.
+        store = ColumnStore()
+        store.dates = array('q', (self.dates[i] for i in indices))
+        store.amounts = array('d', (self.amounts[i] for i in indices))
+        store.amounts_unscaled = array('d', (self.amounts_unscaled[i] for i in indices))
+        store.text_codes = array('i', (self.text_codes[i] for i in indices))
+        store.account_codes = array('i', (self.account_codes[i] for i in indices))
+        store.tagset_codes = array('i', (self.tagset_codes[i] for i in indices))
+        store.texts = list(self.texts)
+        store.accounts = list(self.accounts)
+        store.tagsets = list(self.tagsets)
+        store._text_lookup = dict(self._text_lookup)
+        store._account_lookup = dict(self._account_lookup)
+        store._tagset_lookup = dict(self._tagset_lookup)
+        return store
+
+    def concat(self, *others):
+        #Create a new store with the rows of others after the rows of self.
+        #Codes from others need to be translated since the dictionaries differ. Each row is only copied once.
+        store = self.take(range(len(self)))
+        for other in others:
+            text_map = [store.encode_text(text) for text in other.texts]
+            account_map = [store.encode_account(account) for account in other.accounts]
+            tagset_map = [store.encode_tagset(tags) for tags in other.tagsets]
+            store.dates.extend(other.dates)
+            store.amounts.extend(other.amounts)
+            store.amounts_unscaled.extend(other.amounts_unscaled)
+            store.text_codes.extend(text_map[code] for code in other.text_codes)
+            store.account_codes.extend(account_map[code] for code in other.account_codes)
+            store.tagset_codes.extend(tagset_map[code] for code in other.tagset_codes)
+        return store
+
+    def merge(self, *others):
+        #Merge stores that are all sorted by date into a new sorted store in linear time.
+        #Rows with the same date keep the order of the stores, as if they were concatenated and then sorted.
+        store = self.concat(*others)
+        if all(map(operator.le, store.dates, islice(store.dates, 1, None))):
+            return store
+        offsets = list(accumulate([len(self)] + [len(other) for other in others]))
+        runs = [range(start, stop) for (start, stop) in zip([0] + offsets, offsets)]
+        return store.take(list(heapq.merge(*runs, key=store.dates.__getitem__)))
+
+    def sort_dates(self):
+        #Saved and merged stores are usually already sorted, then there is no need to copy the columns
+        if all(map(operator.le, self.dates, islice(self.dates, 1, None))):
+            return self
+        #sorted is stable so rows with the same date keep their order
+        return self.take(sorted(range(len(self)), key=self.dates.__getitem__))
+
+    def retagged(self, match_many, text_codes=None):
+        #Returns a store with new tags, which shares every other column with this store.
+        #Tags only depend on the text, so the distinct texts are matched in one batch and translated to tag set codes.
+        #If text_codes is given, only those texts are matched again and the rest keep their tags.
+        if text_codes is not None:
+            return self._retagged_texts(match_many, text_codes)
+        store = copy.copy(self)
+        store.tagsets = []
+        store._tagset_lookup = {}
+        text_tags = [store.encode_tagset(tags) for tags in match_many(self.texts)]
+        store.tagset_codes = array('i', (text_tags[code] for code in self.text_codes))
+        store._tag_index = None
+        return store
+
+    def _retagged_texts(self, match_many, text_codes):
+        text_rows = self.text_rows()
+        text_codes = [code for code in text_codes if text_rows[code]]
+        store = copy.copy(self)
+        store.tagsets = list(self.tagsets)
+        store._tagset_lookup = dict(self._tagset_lookup)
+        store.tagset_codes = array('i', self.tagset_codes)
+        new_rows = {}
+        for (code, tags) in zip(text_codes, match_many([self.texts[code] for code in text_codes])):
+            tagset_code = store.encode_tagset(tags)
+            new_rows.setdefault(tagset_code, []).extend(text_rows[code])
+            for i in text_rows[code]:
+                store.tagset_codes[i] = tagset_code
+        #Update the tag index instead of rebuilding it, by clearing the changed rows and adding them to their new tag sets
+        if self._tag_index is not None:
+            changed = bitmap_from_indices([i for code in text_codes for i in text_rows[code]], len(self))
+            store._tagset_bitmaps = [bitmap & ~changed for bitmap in self._tagset_bitmaps]
+            store._tagset_bitmaps += [0] * (len(store.tagsets) - len(self.tagsets))
+            store._tag_index = {tag:bitmap & ~changed for (tag, bitmap) in self._tag_index.items()}
+            for (tagset_code, rows) in new_rows.items():
+                bitmap = bitmap_from_indices(rows, len(self))
+                store._tagset_bitmaps[tagset_code] |= bitmap
+                for tag in store.tagsets[tagset_code]:
+                    store._tag_index[tag] = store._tag_index.get(tag, 0) | bitmap
+        return store
+
+    def text_rows(self):
+        #Inverted index from text code to the rows with that text
+        if self._text_rows is None:
+            self._text_rows = [[] for _ in self.texts]
+            for i, code in enumerate(self.text_codes):
+                self._text_rows[code].append(i)
+        return self._text_rows
+
+    def text_tags(self, code):
+        #Tags of a text, taken from its first row, or None if no row has the text
+        rows = self.text_rows()[code]
+        return self.tagsets[self.tagset_codes[rows[0]]] if rows else None
+
+    def scaled(self, divisor):
+        #Returns a store with the amounts divided by divisor, which shares every other column with this store
+        store = copy.copy(self)
+        store.amounts = array('d', (amount / divisor for amount in self.amounts))
+        return store
+
+    def _build_tag_index(self):
+        #Collect the rows of each tag set, then a tag's bitmap is the union of the tag sets it is part of
+        tagset_rows = [[] for _ in self.tagsets]
+        for i, code in enumerate(self.tagset_codes):
+            tagset_rows[code].append(i)
+        self._tagset_bitmaps = [bitmap_from_indices(rows, len(self)) for rows in tagset_rows]
+        self._tag_index = {}
+        for tags, bitmap in zip(self.tagsets, self._tagset_bitmaps):
+            for tag in tags:
+                self._tag_index[tag] = self._tag_index.get(tag, 0) | bitmap
+
+    def all_bitmap(self):
+        return (1 << len(self)) - 1
+
+    def tag_bitmap(self, tag):
+        if self._tag_index is None:
+            self._build_tag_index()
+        return self._tag_index.get(tag, 0)
+
+    def tagset_bitmap(self, test):
+        #Bitmap of the rows whose tag set passes test. Each distinct tag set is only tested once.
+        if self._tag_index is None:
+            self._build_tag_index()
+        bitmap = 0
+        for tags, tagset_bitmap in zip(self.tagsets, self._tagset_bitmaps):
+            if test(tags):
+                bitmap |= tagset_bitmap
+        return bitmap
@@ -0,0 +1,106 @@
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+
+from array import array
+
+from homeplotter.columnstore import ColumnStore
+
+#Binary file format for saving an AccountData object.
+#
+#The file starts with a fixed preamble (magic bytes, format version and header length), followed by a json header
+#with the length, scales and the dictionaries for text, account and tag sets. After the header, each column of the
+#ColumnStore is stored as a little endian array. Every section is padded to 8 bytes so that the columns are aligned.
+MAGIC = b"HOMEPLOT"
+VERSION = 1
+PREAMBLE = struct.Struct("<8sII")
+COLUMNS = [("dates","q"),("amounts","d"),("amounts_unscaled","d"),("text_codes","i"),("account_codes","i"),("tagset_codes","i")]
+
+def _padding(size):
+    return (8 - size % 8) % 8
+
+def is_ledger_file(file_path):
+    with open(file_path, "rb") as ledger_file:
+        return ledger_file.read(len(MAGIC)) == MAGIC
+
+def write_ledger(file_path, store, scales):
+    #Tag sets are stored as lists of indices into a list of all tags
+    tags = list(dict.fromkeys(tag for tagset in store.tagsets for tag in tagset))
+    tag_ids = {tag:i for (i,tag) in enumerate(tags)}
+    header = {
+        "length":len(store),
+        "scales":scales,
+        "texts":store.texts,
+        "accounts":store.accounts,
+        "tags":tags,
+        "tagsets":[[tag_ids[tag] for tag in tagset] for tagset in store.tagsets],
+    }
+    header_bytes = json.dumps(header).encode("utf-8")
+    header_bytes += b" " * _padding(PREAMBLE.size + len(header_bytes))
+    #Write to a temporary file which then replaces the old file. Rewriting the file in place would break
+    #other processes that have it memory mapped, they keep the old file until they close it.
+    (fd, temp_path) = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(file_path)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as ledger_file:
+            ledger_file.write(PREAMBLE.pack(MAGIC, VERSION, len(header_bytes)))
+            ledger_file.write(header_bytes)
+            for (column, typecode) in COLUMNS:
+                #Columns are either arrays or, for memory mapped stores, memoryviews. Both can be written directly.
+                data = getattr(store, column)
+                if not isinstance(data, array) or data.typecode != typecode:
+                    data = array(typecode, data)
+                if sys.byteorder != "little":
+                    data = array(typecode, data)
+                    data.byteswap()
+                ledger_file.write(data)
+                ledger_file.write(b"\0" * _padding(len(data) * data.itemsize))
+        os.replace(temp_path, file_path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+def _read_preamble(ledger_file, file_path):
+    (magic, version, header_len) = PREAMBLE.unpack(ledger_file.read(PREAMBLE.size))
+    if magic != MAGIC:
+        raise ValueError("\"{file_path}\" is not a saved ledger file.".format(file_path=file_path))
+    if version != VERSION:
+        raise ValueError("Unsupported ledger file version {version}. Supported version: {supported}".format(version=version,supported=VERSION))
+    return json.loads(ledger_file.read(header_len).decode("utf-8"))
+
+def _store_from_header(header, columns):
+    tagsets = [[header["tags"][i] for i in tagset] for tagset in header["tagsets"]]
+    return ColumnStore.from_columns(*columns, header["texts"], header["accounts"], tagsets)
+
+def read_ledger(file_path, memory_map=False):
+    #Returns the ColumnStore and scales saved in the file. Each column is read with one bulk read.
+    #With memory_map, the columns are instead read only views into the memory mapped file.
+    if memory_map and sys.byteorder == "little":
+        return _map_ledger(file_path)
+    with open(file_path, "rb") as ledger_file:
+        header = _read_preamble(ledger_file, file_path)
+        columns = []
+        for (column, typecode) in COLUMNS:
+            data = array(typecode)
+            data.fromfile(ledger_file, header["length"])
+            if sys.byteorder != "little":
+                data.byteswap()
+            ledger_file.read(_padding(len(data) * data.itemsize))
+            columns.append(data)
+    return (_store_from_header(header, columns), header["scales"])
+
+def _map_ledger(file_path):
+    with open(file_path, "rb") as ledger_file:
+        header = _read_preamble(ledger_file, file_path)
+        offset = ledger_file.tell()
+        #The map stays open as long as any of the column views are referenced
+        file_map = mmap.mmap(ledger_file.fileno(), 0, access=mmap.ACCESS_READ)
+    file_view = memoryview(file_map)
+    columns = []
+    for (column, typecode) in COLUMNS:
+        size = header["length"] * array(typecode).itemsize
+        columns.append(file_view[offset:offset + size].cast(typecode))
+        offset += size + _padding(size)
+    return (_store_from_header(header, columns), header["scales"])
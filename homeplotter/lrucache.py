@@ -0,0 +1,42 @@
+import collections
+
+CacheInfo = collections.namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+#Bounded cache which throws away the least recently used entry when it is full.
+#Keeps track of hits and misses so that the size of the cache can be tuned.
+class LRUCache():
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        if key in self._data:
+            self._data.move_to_end(key)
+            self.hits += 1
+            return self._data[key]
+        self.misses += 1
+        return default
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            #First item is the least recently used one
+            self._data.popitem(last=False)
+
+    def clear(self):
+        #Only clears the entries, hit and miss counts are kept
+        self._data.clear()
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._data))
@@ -15,8 +15,10 @@ summed_account = (account_data1/2) + account_data2 + (account_data3/2) + account
 start_date = datetime.date(2021,2,1)
 
 def create_plots(tags,output_path,acc_delta="Month"):
+    summed_account.reset_filter()
+    summed_account.filter_data("date",">=",start_date)
     for tag in tags:
-        summed_account.reset_filter()
+        summed_account.push_filter()
         if tag != "Alla" and tag != "Överskott eller Underskottt":
             summed_account.filter_data("tags","any",tags[tag])
         else:
@@ -24,7 +26,6 @@ def create_plots(tags,output_path,acc_delta="Month"):
             summed_account.filter_data("tags","!=","Överföring")
             if tag == "Alla":
                 summed_account.filter_data("tags","!=","Lön")
-        summed_account.filter_data("date",">=",start_date)
         plt.cla()
         tsdata = summed_account.get_timeseries()
         tsdata.accumulate(1,acc_delta)
@@ -37,12 +38,15 @@ def create_plots(tags,output_path,acc_delta="Month"):
         plt.gcf().autofmt_xdate()
         plt.grid(axis="y")
         plt.savefig(output_path.format(tag=tag))
-        summed_account.reset_filter()
+        summed_account.pop_filter()
+    summed_account.reset_filter()
 
 def create_average(tags,output_path,acc_delta="Month"):
     tag_averages = []
+    summed_account.reset_filter()
+    summed_account.filter_data("date",">=",start_date)
     for tag in tags:
-        summed_account.reset_filter()
+        summed_account.push_filter()
         if tag != "Alla" and tag != "Överskott eller Underskottt":
             summed_account.filter_data("tags","any",tags[tag])
         else:
@@ -50,8 +54,8 @@ def create_average(tags,output_path,acc_delta="Month"):
             summed_account.filter_data("tags","!=","Överföring")
             if tag == "Alla":
                 summed_account.filter_data("tags","!=","Lön")
-        summed_account.filter_data("date",">=",start_date)
         tag_averages.append([tag,math.ceil(summed_account.get_average(acc_delta))])
+        summed_account.pop_filter()
     with open(output_path, "w") as f:
         for special in ["Alla","Lön","Överskott eller Underskottt"]:
             try:
@@ -65,8 +69,11 @@ def create_average(tags,output_path,acc_delta="Month"):
 
 def create_month_totals(tags,output_path,month,year):
     tag_totals = []
+    summed_account.reset_filter()
+    summed_account.filter_data("date",">=",datetime.date(year,month,1))
+    summed_account.filter_data("date","<",datetime.date(year if month != 12 else year +1,month + 1 if month != 12 else 1,1))
     for tag in tags:
-        summed_account.reset_filter()
+        summed_account.push_filter()
         if tag != "Alla" and tag != "Överskott eller Underskottt":
             summed_account.filter_data("tags","any",tags[tag])
         else:
@@ -74,9 +81,8 @@ def create_month_totals(tags,output_path,month,year):
             summed_account.filter_data("tags","!=","Överföring")
             if tag == "Alla":
                 summed_account.filter_data("tags","!=","Lön")
-        summed_account.filter_data("date",">=",datetime.date(year,month,1))
-        summed_account.filter_data("date","<",datetime.date(year if month != 12 else year +1,month + 1 if month != 12 else 1,1))
         tag_totals.append([tag,math.ceil(summed_account.get_total())])
+        summed_account.pop_filter()
     with open(output_path, "w") as f:
         for special in ["Alla","Lön","Överskott eller Underskottt"]:
             try:
@@ -18,20 +18,15 @@ summed_account.filter_data("tags","!=","Överföring")
 
 tags = summed_account.get_tags_by_average(1000,"Övrigt")
 
-month_data = {}
-
-for tag in tags:
-    summed_account.reset_filter()
-    summed_account.filter_data("tags","any",tags[tag])
-    summed_account.filter_data("date",">=",start_date)
-    tsdata = summed_account.get_timeseries()
-    tsdata.accumulate(1,"Month",padding=True)
-    month_data.update({tag:tsdata.get_y()})
+summed_account.reset_filter()
+summed_account.filter_data("date",">=",start_date)
+#All tags are summed per month in one pass over the data
+(months,month_data) = summed_account.get_tag_matrix(tags,"Month",padding=True)
 
 with open('./output/summaries/tag_summary.csv', 'w', newline='', encoding='utf-16') as csvfile:
     csvwriter = csv.writer(csvfile, delimiter=',',
                             quotechar='"', quoting=csv.QUOTE_MINIMAL)
 
-    csvwriter.writerow(["Tag"]+tsdata.get_x())
+    csvwriter.writerow(["Tag"]+months)
     for tag in tags:
         csvwriter.writerow([tag]+month_data[tag])
\ No newline at end of file
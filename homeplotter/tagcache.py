@@ -0,0 +1,119 @@
+import glob
+import hashlib
+import json
+import os
+import tempfile
+
+#Tags of texts saved on disk, so that the next process using the same rules doesn't need to match them again.
+#
+#Each set of rules gets its own file, named after a fingerprint (sha1) of the rules. The file maps a hash of the
+#text (with replacements removed) to its tags. When there is no file for the rules yet, the most recently written
+#file is used as a base: rules are saved in the files, so the tags that differ between them are known, and entries
+#from the base are only used for texts that none of those tags have or match.
+#
+#Files are written to a temporary file which then replaces the old one, so readers always see a whole file.
+class TagCache():
+    def __init__(self, cache_dir, rules, affected, max_files=8):
+        #rules is a list of [tag, pattern, tags added on a match] and affected(text, tags) checks if any of tags matches text
+        self.cache_dir = cache_dir
+        self.rules = rules
+        self.fingerprint = hashlib.sha1(json.dumps(rules).encode("utf-8")).hexdigest()
+        self.file_path = os.path.join(cache_dir, "tags-{fingerprint}.json".format(fingerprint=self.fingerprint))
+        self.max_files = max_files
+        self._affected = affected
+        self._tags = {}
+        self._new_tags = {}
+        self._base_tags = {}
+        self._changed_tags = set()
+        #Raises OSError if cache_dir can't be created
+        os.makedirs(cache_dir, exist_ok=True)
+        data = self._read(self.file_path)
+        if data is not None:
+            self._tags = data["tags"]
+        else:
+            self._load_base()
+
+    @staticmethod
+    def _read(file_path):
+        try:
+            with open(file_path, encoding="utf-8") as cache_file:
+                return json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def text_hash(r_text):
+        return hashlib.sha1(r_text.encode("utf-8")).hexdigest()
+
+    def _cache_files(self):
+        #Cache files, most recently written first
+        file_times = []
+        for file_path in glob.glob(os.path.join(self.cache_dir, "tags-*.json")):
+            try:
+                file_times.append((os.path.getmtime(file_path), file_path))
+            except OSError:
+                #Removed by another process
+                pass
+        return [file_path for (_, file_path) in sorted(file_times, reverse=True)]
+
+    def _load_base(self):
+        for file_path in self._cache_files():
+            data = self._read(file_path)
+            if data is not None:
+                break
+        else:
+            return
+        base_rules = {tag:rule for (tag, *rule) in data["rules"]}
+        rules = {tag:rule for (tag, *rule) in self.rules}
+        changed_tags = {tag for tag in set(base_rules) | set(rules) if base_rules.get(tag) != rules.get(tag)}
+        #Tags are returned in the order of the rules, so the tags that didn't change need to be in the same order
+        base_order = [tag for tag in base_rules if tag in rules and tag not in changed_tags]
+        order = [tag for tag in rules if tag in base_rules and tag not in changed_tags]
+        if base_order == order:
+            self._base_tags = data["tags"]
+            self._changed_tags = changed_tags
+
+    def get(self, r_text):
+        key = self.text_hash(r_text)
+        tags = self._tags.get(key)
+        if tags is None:
+            tags = self._base_tags.get(key)
+            if tags is None or not self._changed_tags.isdisjoint(tags) or self._affected(r_text, self._changed_tags):
+                return None
+            self._new_tags[key] = tags
+        return tags
+
+    def update(self, text_tags):
+        for (r_text, tags) in text_tags.items():
+            self._new_tags[self.text_hash(r_text)] = tags
+
+    def save(self):
+        if len(self._new_tags) == 0:
+            return
+        #Another process may have written the file since it was read, keep its entries as well
+        data = self._read(self.file_path)
+        if data is not None:
+            self._tags.update(data["tags"])
+        self._tags.update(self._new_tags)
+        self._new_tags = {}
+        #The cache is only an optimization, so if it can't be written the matches are just not saved
+        try:
+            (fd, temp_path) = tempfile.mkstemp(dir=self.cache_dir, prefix=".tags-", suffix=".tmp")
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as temp_file:
+                json.dump({"rules":self.rules, "tags":self._tags}, temp_file)
+            os.replace(temp_path, self.file_path)
+        except OSError:
+            os.remove(temp_path)
+            return
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        #Only keep the most recent files
+        for file_path in self._cache_files()[self.max_files:]:
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
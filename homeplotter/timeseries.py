@@ -1,48 +1,65 @@
-import datetime
 import calendar
+import copy
+import datetime
+
+#Periods used by accumulate, as functions from date to period id and from period id to its first date.
+#Period ids increase by one for each period. Ordinal 1 (0001-01-01) is a monday, so weeks start on mondays.
+PERIODS = {
+    "Day":(lambda date: date.toordinal(), lambda period: datetime.date.fromordinal(period)),
+    "Week":(lambda date: (date.toordinal()-1)//7, lambda period: datetime.date.fromordinal(period*7+1)),
+    "Month":(lambda date: date.year*12+date.month-1, lambda period: datetime.date(period//12,period%12+1,1)),
+    "Year":(lambda date: date.year, lambda period: datetime.date(period,1,1)),
+}
+
+def complete_periods(first_day, last_day, delta_unit, padding=False):
+    #Returns the ids of the first and last period that are completely within first_day to last_day.
+    #With padding, the periods that are only partly within are included as well.
+    (period_id, period_start) = PERIODS[delta_unit]
+    first = period_id(first_day)
+    last = period_id(last_day)
+    if not padding and period_start(first) != first_day:
+        first += 1
+    if not padding and period_id(last_day + datetime.timedelta(1)) == last:
+        last -= 1
+    return (first, last)
+
+def _shift_date(date, periods, unit):
+    #Moves date the number of periods, months and years keep the day of the month if possible
+    if unit == "Day":
+        return date + datetime.timedelta(periods)
+    if unit == "Week":
+        return date + datetime.timedelta(7 * periods)
+    months = periods if unit == "Month" else 12 * periods
+    (year, month) = divmod(date.year * 12 + date.month - 1 + months, 12)
+    return datetime.date(year, month + 1, min(date.day, calendar.monthrange(year, month + 1)[1]))
 
 class TimeSeries():
     def __init__(self, data, daterange=None):
         #Only keep date and amount, even if more info is passed
-        self.data=list(map(lambda x: [x[0],x[1]], data))
-        if daterange is not None:
-            #If daterange is set, append the start and end dates
-            self.data.append([daterange[0],0])
-            self.data.append([daterange[1],0])
-        self.data=sorted(self.data, key = lambda x: x[0])
-        self._sum_dates()
-        self._add_missing_dates()
+        self.data=self._sum_dates(data, daterange)
+        #Last day covered by the series, after accumulating this is the last day of the last bucket
+        self._last_day = self.data[-1][0] if len(self.data) > 0 else None
+        #Number and unit of periods in each point
+        self._step = (1,"Day")
         #If data is too short, give time delta 0 (next best thing instead of infinity which it can't handle)
         #This will definately come back and haunt me later
-        self.timedelta = self.data[1][0]-self.data[0][0] if len(data) >= 2 else datetime.timedelta(0)
-
-    def _sum_dates(self):
-        #Sum all expenses on a given date into one post
-        i = 0
-        data_len = len(self.data)
-        while i < data_len:
-            # Find all matches which has the same date as the one at index i. 
-            # From https://stackoverflow.com/questions/946860/using-pythons-list-index-method-on-a-list-of-tuples-or-objects
-            matches=[index for index, post  in enumerate(self.data) if post[0] == self.data[i][0]]
-            #Ignore the first (last after reversing) one since it matches itself. Also reverse it since we want to delete the index without affecting the order 
-            #Last tip from https://stackoverflow.com/questions/11303225/how-to-remove-multiple-indexes-from-a-list-at-the-same-time
-            for j in sorted(matches[1:],reverse=True):
-                #Add the amount on the current date together with the amount the matched date
-                self.data[i][1] += self.data[j][1]
-                del self.data[j]
-            #Since the length might have change, we need to recalculate it:
-            data_len = len(self.data)
-            i += 1
+        self.timedelta = self.data[1][0]-self.data[0][0] if len(data) >= 2 and len(self.data) >= 2 else datetime.timedelta(0)
 
-    def _add_missing_dates(self):
-        #Adds dates that are missing from the series and set that expense to zero.
-        #Assumes that the series has been sorted. Only called after sorting in initialization so its ok.
-        for i in range(0,len(self.data)-1):
-            days_between=(self.data[i+1][0]-self.data[i][0]).days
-            for j in range(1,days_between):
-                self.data.append([self.data[i][0]+datetime.timedelta(j),0])
-        #New dates are added to the end of the list so it needs to be sorted again
-        self.data=sorted(self.data, key = lambda x: x[0])
+    @staticmethod
+    def _sum_dates(data, daterange=None):
+        #Sum all expenses on a given date into one post, and add the missing dates (between the first and last date
+        #of the data and daterange) with the expense zero. This is done in one pass into a list with one slot per day,
+        #so the data doesn't need to be sorted. Posts on the same date are summed in the order they are given.
+        ordinals = [post[0].toordinal() for post in data]
+        if daterange is not None:
+            ordinals += [daterange[0].toordinal(), daterange[1].toordinal()]
+        if len(ordinals) == 0:
+            return []
+        first = min(ordinals)
+        amounts = [0] * (max(ordinals) - first + 1)
+        for (ordinal, post) in zip(ordinals, data):
+            amounts[ordinal - first] += post[1]
+        return [[datetime.date.fromordinal(first + i), amount] for (i, amount) in enumerate(amounts)]
 
     def get_x(self):
         return [data[0] for data in self.data]
@@ -51,84 +68,86 @@ class TimeSeries():
         return [data[1] for data in self.data]
     
     def accumulate(self,delta,delta_unit="Day",padding=False):
-        #Loop backwards, if the iterator is not divisible by delta, add its value to cum_sum and delete it.
-        #If its divisible by delta, offload cum_sum.
-        if self.timedelta.days > 1:
-            raise NotImplementedError("Accumulating twice is not implemented")
+        #Sums the series into buckets of delta days, weeks, months or years, each labeled with its first date.
+        #The buckets are aligned to the end of the series. Incomplete periods (and buckets) at the start and end are
+        #dropped, or filled out with zeros if padding is set. An accumulated series can be accumulated again into
+        #larger buckets, since each point is summed into the bucket of its date. If it is accumulated again with the same
+        #unit, delta is the number of current points in each bucket, so accumulating by 2 and then 5 is the same as by 10.
+        if delta_unit not in PERIODS:
+            raise ValueError("delta_unit must be Day/Week/Month/Year")
+        if delta_unit == self._step[1]:
+            delta *= self._step[0]
 
         if len(self.data)<2:
             #If data is less than 2 data points, accumulate doesn't change the data.
-            return 
-        
-        if delta_unit == "Day":
-            date_len = self.data[-1][0]-self.data[0][0]+datetime.timedelta(1)
-            if padding and (date_len.days%delta) != 0:
-                self.data.insert(0,[self.data[0][0]-datetime.timedelta(delta-(date_len.days%delta)),0])
-                date_len = self.data[-1][0]-self.data[0][0]+datetime.timedelta(1)
-            end_date = self.data[-1][0]
-            stop_fun = lambda date: (delta-((end_date-date).days+1))%delta == 0
-        elif delta_unit == "Week":
-            if delta != 1:
-                raise NotImplementedError("delta > 1 for delta_unit \"Week\" is not implemented.")
-            #Need to add some logic if it is 1 week, two weeks, etc
-            if padding and self.data[0][0].weekday() != 0:
-                self.data.insert(0,[self.data[0][0]-datetime.timedelta(self.data[0][0].weekday()),0])
-            if padding and self.data[-1][0].weekday() != 6:
-                self.data.append([self.data[-1][0]+datetime.timedelta(6-self.data[-1][0].weekday()),0])
-            elif self.data[-1][0].weekday() != 6:
-                while len(self.data) > 0 and self.data[-1][0].weekday() != 6:
-                    del self.data[-1]
-            stop_fun = lambda date: date.weekday()==0
-        elif delta_unit == "Month":
-            if delta != 1:
-                raise NotImplementedError("delta > 1 for delta_unit \"Month\" is not implemented.")
-            if padding and self.data[0][0].day != 1:
-                self.data.insert(0,[datetime.date(self.data[0][0].year,self.data[0][0].month,1),0])
-
-            month = self.data[-1][0].month
-            year = self.data[-1][0].year
-            days_of_month = calendar.monthrange(year,month)[1]
-            days_of_prev_month = calendar.monthrange(year if month > 1 else year - 1,month - 1 if month > 1 else 12)[1]
-
-            if padding and self.data[-1][0].day != days_of_month:
-                self.data.append([datetime.date(year,month,days_of_month),0])
-
-            elif self.data[-1][0].day != days_of_month:
-                while len(self.data) > 0 and self.data[-1][0].day != days_of_prev_month:
-                    del self.data[-1]
-            stop_fun = lambda date: date.day==1   
-        elif delta_unit == "Year":
-            if delta != 1:
-                raise NotImplementedError("delta > 1 for delta_unit \"Year\" is not implemented.")
-            if padding and self.data[0][0].day != 1 and self.data[0][0].month != 1:
-                self.data.insert(0,[datetime.date(self.data[0][0].year,1,1),0])
-            if padding and self.data[-1][0].day != 31 and self.data[-1][0].month != 12:
-                self.data.append([datetime.date(self.data[-1][0].year,12,31),0])
+            return
 
-            elif self.data[-1][0].month != 12 and self.data[-1][0].day != 31:
-                last_year = self.data[-1][0].year-1
-                while len(self.data) > 0 and self.data[-1][0].year != last_year:
-                    del self.data[-1]
-            stop_fun = lambda date: date.month == 1 and date.day == 1         
-        else:
-            raise ValueError("delta_unit must be Day/Week/Month/Year")
-
-        if len(self.data) == 0:
+        (period_id,period_start) = PERIODS[delta_unit]
+        first_day = self.data[0][0]
+        (first,last) = complete_periods(first_day,max(self._last_day,self.data[-1][0]),delta_unit,padding)
+        if last < period_id(first_day):
             raise ValueError("Delta {delta} {delta_unit} larger than number of points in time series".format(delta=delta,delta_unit=delta_unit))
 
-        cum_sum = 0
-        for i in range(len(self.data)-1,-1,-1):
-            if stop_fun(self.data[i][0]):
-                self.data[i][1] += cum_sum
-                cum_sum = 0
-            else:
-                cum_sum += self.data[i][1]
-                del self.data[i]
+        #If the number of periods isn't divisible by delta, move the start so that the buckets end with the last period
+        rest = (last-first+1)%delta
+        if rest != 0:
+            first += rest-delta if padding else rest
+        bucket_count = max((last-first+1)//delta,0)
+        amounts = [0]*bucket_count
+        for (date,amount) in self.data:
+            offset = period_id(date)-first
+            if 0 <= offset < bucket_count*delta:
+                amounts[offset//delta] += amount
+        self.data = [[period_start(first+i*delta),amount] for (i,amount) in enumerate(amounts)]
+        self._last_day = period_start(first+bucket_count*delta)-datetime.timedelta(1)
+        self._step = (delta,delta_unit)
         self.timedelta = self.data[1][0]-self.data[0][0] if len(self.data) > 1 else datetime.timedelta(-1)
 
     def moving_average(self,window):
-        for i in range(window-1,len(self.data)):
-            self.data[i][1]=sum([point[1] for point in self.data[i-window+1:i+1]])/window
-        del self.data[:window-1]
+        #Replaces the series with its simple moving average, see rolling
+        self.data = self.rolling(window).data
 
-    
\ No newline at end of file
+    def rolling(self,window,kind="simple",unit="Day"):
+        #Returns a new series with a rolling average over window points, using running sums so it's linear in the length.
+        #  simple:   average of the point and the window-1 points before it. The first window-1 points are dropped.
+        #  centered: average of the window points around the point. Points without a full window are dropped.
+        #  ewm:      exponentially weighted average with span window, alpha = 2/(window+1). Every point is kept.
+        #  calendar: average of the points in the last window units (Day/Week/Month/Year) up to and including the point,
+        #            for example the trailing 3 months. Points whose window starts before the series are dropped.
+        series = copy.copy(self)
+        points = self.data
+        if kind in ["simple","centered"]:
+            data = []
+            if len(points) >= window:
+                window_sum = sum([point[1] for point in points[:window]])
+                data.append(window_sum/window)
+                for i in range(window,len(points)):
+                    window_sum += points[i][1]-points[i-window][1]
+                    data.append(window_sum/window)
+            #Each average is labeled with the last point of its window, or with the middle point when centered
+            offset = window-1 if kind == "simple" else window//2
+            series.data = [[points[i+offset][0],average] for (i,average) in enumerate(data)]
+        elif kind == "ewm":
+            alpha = 2/(window+1)
+            series.data = []
+            for (date,amount) in points:
+                average = amount if len(series.data) == 0 else alpha*amount+(1-alpha)*average
+                series.data.append([date,average])
+        elif kind == "calendar":
+            if unit not in PERIODS:
+                raise ValueError("Unsuported unit \"{unit}\". Only Day/Week/Month/Year are supported.".format(unit=unit))
+            series.data = []
+            window_sum = 0
+            first = 0
+            for (i,(date,amount)) in enumerate(points):
+                window_sum += amount
+                #The window is the days after start up to and including date
+                start = _shift_date(date,-window,unit)
+                while points[first][0] <= start:
+                    window_sum -= points[first][1]
+                    first += 1
+                if start >= points[0][0]-datetime.timedelta(1):
+                    series.data.append([date,window_sum/(i-first+1)])
+        else:
+            raise ValueError("Unsuported kind \"{kind}\". Only simple, centered, ewm and calendar are supported.".format(kind=kind))
+        return series
@@ -2,7 +2,8 @@ import os
 import datetime
 import pytest
 
-from homeplotter.accountdata import AccountData
+from homeplotter.accountdata import AccountData, get_date_parser
+from homeplotter.columnstore import ColumnStore
 
 resource_path = os.path.abspath(os.path.join(os.path.dirname( __file__ ), '..', 'example_data'))
 tag_path = os.path.join(resource_path,"tags.json")
@@ -41,6 +42,66 @@ def test_add():
     #Length of get_data should be the sum of both
     assert(len(sum_data.get_data())==len(acc_data1.get_data())+len(acc_data2.get_data()))
 
+def test_add__several():
+    acc_data1 = AccountData(data_path1,tag_nested_path)
+    acc_data2 = AccountData(data_path2,account_name="other_data")
+    acc_data3 = AccountData(data_path1,account_name="third_data")
+    summed_pairwise = acc_data1 + acc_data2/2 + acc_data3
+    summed_merged = AccountData.merge([acc_data1,acc_data2/2,acc_data3])
+    assert(summed_pairwise.get_data()==summed_merged.get_data())
+    assert(summed_pairwise._scales==summed_merged._scales)
+    #Data without the tagger should be tagged with the tagger of the result
+    summed_merged.filter_data("account","==","other_data")
+    assert(len(summed_merged.get_tags())>0)
+
+def test_add__retag_after_tagger_change():
+    acc_data1 = AccountData(data_path1,tag_nested_path)
+    acc_data2 = AccountData(data_path2,account_name="other_data")
+    acc_data1.tagger.append("new_tag","Lorem")
+    #acc_data1 was tagged before the tagger changed, so it needs to be retagged when added
+    sum_data = acc_data1 + acc_data2
+    sum_data.filter_data("tags","==","new_tag")
+    assert(sum_data.get_column("text")==["Lorem Ipsum","Lorem Ipsum"])
+
+@pytest.mark.parametrize("processes",[1,2])
+def test_from_files(processes):
+    acc_data1 = AccountData(data_path1,tag_nested_path)
+    acc_data2 = AccountData(data_path2,tag_nested_path,account_name="other_data")
+    summed_account = acc_data1/2 + acc_data2
+    from_files_account = AccountData.from_files([(data_path1,"data1",1/2),(data_path2,"other_data",1)],tag_nested_path,processes=processes)
+    assert(from_files_account.get_data()==summed_account.get_data())
+    assert(from_files_account._scales==summed_account._scales)
+    #Levels are taken from the tagger, so it needs to be set
+    assert(from_files_account.get_tags("==",0)==summed_account.get_tags("==",0))
+
+def test_retag__processes():
+    acc_data = AccountData(data_path1,tag_nested_path)
+    acc_data_processes = AccountData(data_path1,tag_nested_path,tag_processes=2)
+    acc_data_processes._retag()
+    assert(acc_data.get_data()==acc_data_processes.get_data())
+
+def test_retag__incremental():
+    acc_data = AccountData(data_path1,tag_nested_path)
+    #Filter first so that the tag index is built before the change
+    acc_data.filter_data("tags","any",["B"])
+    acc_data.get_data()
+    acc_data.tagger.append("new_tag","Lorem",parent_tag="A")
+    acc_data.tagger.remove("B1")
+    #Only rows affected by the changed tags should be matched again
+    assert(acc_data._changed_texts() is not None)
+    acc_data._retag()
+    acc_data.reset_filter()
+    full_retag = AccountData(data_path1)
+    full_retag.tagger = acc_data.tagger
+    full_retag._retag()
+    assert(acc_data.get_data()==full_retag.get_data())
+    for tag in ["new_tag","A","B","B1"]:
+        acc_data.reset_filter()
+        full_retag.reset_filter()
+        acc_data.filter_data("tags","==",tag)
+        full_retag.filter_data("tags","==",tag)
+        assert(acc_data.get_data()==full_retag.get_data())
+
 def test_div():
     acc_data = AccountData(data_path1)
     acc_data_div = acc_data/2
@@ -48,6 +109,18 @@ def test_div():
     assert(sum(acc_data.get_column("amount"))/2==sum(acc_data_div.get_column("amount")))
     assert(len(acc_data.get_data())==len(acc_data_div.get_data()))
 
+def test_div__shares_data():
+    acc_data = AccountData(data_path1,tag_nested_path)
+    acc_data_div = acc_data/2
+
+    #Division should not copy the data, only scale the amounts when they are read
+    assert(acc_data_div._store is acc_data._store)
+    assert(acc_data_div.get_total()==sum(amount/2 for amount in acc_data.get_column("amount")))
+    acc_data_div.filter_data("amount",">=",100)
+    assert(all(amount>=100 for amount in acc_data_div.get_column("amount")))
+    #The original should not be affected
+    assert(acc_data.get_data()[0][acc_data.columns["amount"]]==100)
+
 def test_div__property():
     acc_data1 = AccountData(data_path1,tag_nested_path)
     acc_data2 = AccountData(data_path2,tag_nested_path,account_name="other_data")
@@ -135,6 +208,12 @@ def test_get_average__filtered():
     acc_data.filter_data("date","<",datetime.date(2020,12,23))
     assert(acc_data.get_average("Week")==(1000+100-25000)/1)
 
+def test_get_average__shorter_than_unit():
+    acc_data = AccountData(data_path1,tag_path)
+    acc_data.filter_data("date","<",datetime.date(2020,12,31))
+    assert(acc_data.get_average("Month")==0)
+    assert(acc_data.get_average("Year")==0)
+
 def test_get_total():
     acc_data = AccountData(data_path1,tag_path)
     assert(acc_data.get_total()==-44559.5)
@@ -143,6 +222,59 @@ def test_get_total():
     acc_data.filter_data("date",">",datetime.date(2020,12,25))
     assert(acc_data.get_total()==200.0)
 
+def test_get_total__date_not_equal():
+    acc_data = AccountData(data_path1,tag_path)
+    acc_data.filter_data("date","!=",datetime.date(2021,1,4))
+    assert(acc_data.get_total()==sum(acc_data.get_column("amount")))
+    assert(acc_data.get_total()==-45059.5)
+    #Date ranges still share the cube with the != filter
+    acc_data.filter_data("date",">",datetime.date(2020,12,25))
+    assert(acc_data.get_total()==sum(acc_data.get_column("amount")))
+    assert(acc_data._cube_cache.info().currsize==1)
+
+def test_get_range_total():
+    acc_data = AccountData(data_path1,tag_path)
+    start = datetime.date(2020,12,26)
+    end = datetime.date(2021,1,4)
+    acc_data.filter_data("tags","==","tag2")
+    assert(acc_data.get_range_total(start,end)==200.0)
+    acc_data.filter_data("date",">",datetime.date(2020,12,25))
+    assert(acc_data.get_range_total(start,end)==acc_data.get_total())
+    #Date filters only limit the range, so the cube for tag2 should be reused
+    assert(acc_data._cube_cache.info().currsize==1)
+    acc_data.reset_filter()
+    acc_data.filter_data("date",">=",start)
+    acc_data.filter_data("tags","==","tag2")
+    assert(acc_data.get_range_total(start,end,tag="tag2")==acc_data.get_total())
+    acc_data.reset_filter()
+    assert(acc_data.get_range_total(start,end,account="data1")==sum(acc_data.get_column("amount")[-9:]))
+    assert(acc_data.get_range_total(start,end,account="other")==0)
+
+def test_get_range_total__cube_on_repeat():
+    acc_data = AccountData(data_path1,tag_path)
+    start = datetime.date(2020,12,26)
+    end = datetime.date(2021,1,4)
+    acc_data.filter_data("amount","<",0.0)
+    expected = sum(amount for (date,amount) in zip(acc_data.get_column("date"),acc_data.get_column("amount")) if start <= date <= end)
+    #The first query sums the filtered rows, the cube is only built when the filters are queried again
+    assert(acc_data.get_range_total(start,end)==expected)
+    assert(not any(acc_data._cube_cache._data.values()))
+    assert(acc_data.get_range_total(start,end)==expected)
+    assert(any(acc_data._cube_cache._data.values()))
+    assert(acc_data.get_total()==sum(acc_data.get_column("amount")))
+
+def test_get_range_total__tag_and_date_filter():
+    acc_data = AccountData(data_path1,tag_path)
+    start = datetime.date(2020,12,26)
+    end = datetime.date(2021,1,4)
+    acc_data.filter_data("date",">=",datetime.date(2020,12,1))
+    acc_data.push_filter()
+    acc_data.filter_data("tags","==","tag1")
+    expected = sum(amount for (date,amount) in zip(acc_data.get_column("date"),acc_data.get_column("amount")) if start <= date <= end)
+    acc_data.pop_filter()
+    #Same number of filters as the current ones, but the tag filter must still be applied when the cube is built
+    assert([acc_data.get_range_total(start,end,tag="tag1") for _ in range(3)]==[expected]*3)
+
 def test_get_tags():
     acc_data = AccountData(data_path1,tag_file=tag_path)
     assert(sorted(acc_data.get_tags())==["tag1","tag2","tag3","överföring"])
@@ -163,12 +295,73 @@ def test_save_load(tmp_path):
     acc_data._expenses == acc_data_loaded._expenses
     acc_data._daterange == acc_data_loaded._daterange
 
+def test_save_load__binary(tmp_path):
+    acc_data = AccountData(data_path1,tag_file=tag_nested_path)/2 + AccountData(data_path2,account_name="other_data")
+    acc_data.save(tmp_path/"test_save_load_data.ledger",file_format="binary")
+    acc_data_loaded = AccountData(tmp_path/"test_save_load_data.ledger")
+
+    #The binary format should give back exactly the same data and scales
+    assert(acc_data._expenses == acc_data_loaded._expenses)
+    assert(acc_data._daterange == acc_data_loaded._daterange)
+    assert(acc_data._scales == acc_data_loaded._scales)
+
+def test_save_load__memory_map(tmp_path):
+    acc_data = AccountData(data_path1,tag_file=tag_nested_path)
+    acc_data.save(tmp_path/"test_save_load_data.ledger",file_format="binary")
+    acc_data_mapped = AccountData(tmp_path/"test_save_load_data.ledger",memory_map=True)
+
+    assert(acc_data._expenses == acc_data_mapped._expenses)
+    #The columns should be views into the file, not copies
+    assert(type(acc_data_mapped._store.amounts) == memoryview)
+    #Filtering and totals should work the same on the mapped data
+    acc_data.filter_data("tags","any",["A"])
+    acc_data_mapped.filter_data("tags","any",["A"])
+    assert(acc_data.get_total() == acc_data_mapped.get_total())
+    #Mapped data can still be combined with other data and saved again
+    summed_data = acc_data_mapped/2 + AccountData(data_path2)
+    summed_data.save(tmp_path/"test_save_load_summed.ledger",file_format="binary")
+    assert(AccountData(tmp_path/"test_save_load_summed.ledger")._expenses == summed_data._expenses)
+
+def test_save__memory_mapped_file(tmp_path):
+    ledger_path = tmp_path/"test_save_mapped.ledger"
+    acc_data = AccountData(data_path1)+AccountData(data_path2,account_name="other")
+    acc_data.save(ledger_path,file_format="binary")
+    acc_data_mapped = AccountData(ledger_path,memory_map=True)
+    #Saving a smaller ledger to the mapped file should not change the data that is already mapped
+    AccountData(data_path1).save(ledger_path,file_format="binary")
+    assert(acc_data_mapped._expenses == acc_data._expenses)
+    #A mapped ledger can be saved to its own file
+    acc_data_mapped.save(ledger_path,file_format="binary")
+    assert(AccountData(ledger_path)._expenses == acc_data._expenses)
+    assert([path.name for path in tmp_path.iterdir()] == ["test_save_mapped.ledger"])
+
+def test_save__unsupported_format(tmp_path):
+    acc_data = AccountData(data_path1)
+    with pytest.raises(ValueError):
+        acc_data.save(tmp_path/"test_save.xml",file_format="xml")
+
 def test_get_tags_by_average():
     acc_data = AccountData(data_path1,tag_file=tag_nested_path)
     assert(acc_data.get_tags_by_average(10000)=={'tag2': ['tag2'], 'tagABC, Other': ['*tagABC', 'A', 'B']})
     assert(acc_data.get_tags_by_average(100000,other_suffix="Övrig")=={'Övrig': ['tag2', 'tagABC']})
     assert(acc_data.get_tags_by_average(0)=={'tag2': ['tag2'], 'A': ['A'], 'B1': ['B1'], 'B23': ['B23'], 'tagABC, Other': ['*tagABC', '*B']})
 
+@pytest.mark.parametrize("unit,padding",[("Week",False),("Week",True),("Month",True),("Day",False)])
+def test_get_tag_matrix(unit,padding):
+    acc_data = AccountData(data_path1,tag_file=tag_nested_path)/2
+    acc_data.filter_data("date",">=",datetime.date(2020,12,14))
+    tag_groups = {"tag2":["tag2"],"tagABC, Other":["*tagABC","*B"],"A":["A"],"None":["Non-existing"]}
+    (periods,matrix) = acc_data.get_tag_matrix(tag_groups,unit,padding)
+    #Should be the same as filtering and accumulating each tag group
+    for label in tag_groups:
+        acc_data.push_filter()
+        acc_data.filter_data("tags","any",tag_groups[label])
+        ts = acc_data.get_timeseries()
+        ts.accumulate(1,unit,padding=padding)
+        acc_data.pop_filter()
+        assert(periods==ts.get_x())
+        assert(matrix[label]==ts.get_y())
+
 def test_get_tags_by_average__keep_filter():
     acc_data = AccountData(data_path1,tag_file=tag_nested_path)
     acc_data.filter_data("tags","!=","tag2")
@@ -181,6 +374,21 @@ def test_get_tags_by_average__keep_filter():
     assert(original_data==new_data)
     assert(original_daterange==new_daterange)
 
+def test_get_date_parser():
+    for date_strings in [["2021-01-04"],["2021/01/04"],["Reserverat","2021.01.04"]]:
+        parse_date = get_date_parser(date_strings)
+        assert(parse_date(date_strings[-1])==datetime.date(2021,1,4))
+        assert(parse_date("Reserverat")==datetime.date.today())
+
+def test_account_reader__chunks():
+    #Reading the file in small chunks should give the same data as reading it at once
+    acc_data = AccountData(data_path1,tag_nested_path)
+    acc_data_chunked = AccountData(data_path1,tag_nested_path)
+    acc_data_chunked._store = ColumnStore()
+    acc_data_chunked._account_reader(data_path1,"data1",chunk_size=3)
+    acc_data_chunked._sort_dates()
+    assert(acc_data.get_data()==acc_data_chunked._store.rows())
+
 if __name__=="__main__":
     test_init()
     test_get_data()
@@ -76,3 +76,61 @@ def test_filter__empty():
     #It should be possible to still call get_timeseries()
     assert(type(acc_data.get_timeseries())==TimeSeries)
 
+
+def test_filter__chained_order():
+    #Filters are evaluated together, the order they are given in should not affect the result
+    acc_data1 = AccountData(data_path1,tag_path)
+    acc_data1.filter_data("tags","!=","tag1")
+    acc_data1.filter_data("amount","<",1000)
+    acc_data1.filter_data("date",">=",datetime.date(2020,12,20))
+    acc_data2 = AccountData(data_path1,tag_path)
+    acc_data2.filter_data("date",">=",datetime.date(2020,12,20))
+    acc_data2.filter_data("amount","<",1000)
+    acc_data2.filter_data("tags","!=","tag1")
+    assert(acc_data1.get_data()==acc_data2.get_data())
+    assert(len(acc_data1.get_data())>0)
+
+def test_filter__after_get_data():
+    #Filtering after the data has been read should continue from the already filtered data
+    acc_data = AccountData(data_path1,cat_path)
+    acc_data.filter_data("amount",">=",100)
+    first_len = len(acc_data.get_data())
+    acc_data.filter_data("amount","<",300)
+    assert(len(acc_data.get_data())<first_len)
+    assert(all(100<=amount<300 for amount in acc_data.get_column("amount")))
+
+@pytest.mark.parametrize("fun",[">",">=","==","<=","<"] )
+def test_filter__date_range(fun):
+    #Date filters are answered with a binary search, they should give the same result as comparing every row
+    acc_data = AccountData(data_path1,cat_path)
+    all_data = acc_data.get_data()
+    filter_date = datetime.date(2020,12,21)
+    acc_data.filter_data("date",fun,filter_date)
+    compare = {">":lambda d:d>filter_date,">=":lambda d:d>=filter_date,"==":lambda d:d==filter_date,"<=":lambda d:d<=filter_date,"<":lambda d:d<filter_date}
+    assert(acc_data.get_data()==[data for data in all_data if compare[fun](data[0])])
+
+def test_filter__date_range_empty():
+    acc_data = AccountData(data_path1,cat_path)
+    acc_data.filter_data("date",">",datetime.date(2020,12,25))
+    acc_data.filter_data("date","<",datetime.date(2020,12,20))
+    assert(acc_data.get_data()==[])
+    assert(acc_data.get_total()==0)
+
+def test_push_pop_filter():
+    acc_data = AccountData(data_path1,tag_path)
+    acc_data.filter_data("date",">=",datetime.date(2020,12,20))
+    base_data = acc_data.get_data()
+    base_daterange = list(acc_data._f_daterange)
+    acc_data.push_filter()
+    acc_data.filter_data("tags","==","tag1")
+    acc_data.filter_data("date","<",datetime.date(2020,12,25))
+    assert(acc_data.get_data()!=base_data)
+    #Popping should go back to the filter that was pushed
+    acc_data.pop_filter()
+    assert(acc_data.get_data()==base_data)
+    assert(acc_data._f_daterange==base_daterange)
+
+def test_pop_filter__empty():
+    acc_data = AccountData(data_path1,tag_path)
+    with pytest.raises(ValueError):
+        acc_data.pop_filter()
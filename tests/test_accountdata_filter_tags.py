@@ -1,6 +1,8 @@
 import os
 import pytest
 
+from array import array
+
 from homeplotter.accountdata import AccountData
 
 resource_path = os.path.abspath(os.path.join(os.path.dirname( __file__ ), '..', 'example_data'))
@@ -100,3 +102,27 @@ def test_filter__tags_asterix__no_modify():
     assert(tag_list == ["*B","B1"])
 
 
+
+def test_filter__cache():
+    acc_data = AccountData(data_path1,tag_file=tag_path)
+    acc_data.filter_data("tags","any",["tag1","tag3"])
+    first_data = acc_data.get_data()
+    assert(acc_data.filter_cache_info().misses==1)
+    #The same filters in another order should be taken from the cache
+    acc_data.reset_filter()
+    acc_data.filter_data("tags","any",["tag3","tag1"])
+    assert(acc_data.get_data()==first_data)
+    assert(acc_data.filter_cache_info().hits==1)
+    #Selections are cached as packed arrays instead of lists
+    assert(type(acc_data._get_index()) is array)
+
+def test_filter__cache_retag():
+    acc_data = AccountData(data_path1,tag_file=tag_path)
+    acc_data.filter_data("tags","==","tag1")
+    first_len = len(acc_data.get_data())
+    #Changing the tagger and retagging should not give the cached result
+    acc_data.tagger.append("tag1","Lorem")
+    acc_data._retag()
+    acc_data.reset_filter()
+    acc_data.filter_data("tags","==","tag1")
+    assert(len(acc_data.get_data())==first_len+1)
@@ -1,9 +1,12 @@
+import json
 import os
+import re
 
-from homeplotter.categorizer import Categorizer
+from homeplotter.categorizer import Categorizer, remove_replacements
 
 
 resource_path = os.path.abspath(os.path.join(os.path.dirname( __file__ ), '..', 'example_data'))
+tag_path = os.path.join(resource_path,"tags.json")
 tag_nested_path = os.path.join(resource_path,"tags_nested.json")
 
 def test_get_tag_children():
@@ -12,5 +15,144 @@ def test_get_tag_children():
         assert(all([x in tagger.get_tag_children("B") for x in ["B1","B23"]]))
         assert(len(tagger.get_tag_children("A"))==0)
 
+def test_hierarchy__append_remove():
+    tagger = Categorizer(tag_nested_path)
+    assert(tagger.get_level("B1")==2)
+    assert(tagger.get_ancestors("B1")==["B","tagABC"])
+    assert(tagger.is_descendant("B1","tagABC"))
+    assert(not tagger.is_descendant("A","B"))
+    tagger.append("new_tag","Ipsum",parent_tag="B1")
+    assert(tagger.get_tag_children("B1")==["new_tag"])
+    assert(tagger.get_level("new_tag")==3)
+    assert(tagger.is_descendant("new_tag","B"))
+    assert(3 in tagger.get_levels())
+    #Removing a tag should remove its children from the hierarchy as well
+    tagger.remove("B")
+    assert(tagger.get_tag_children("tagABC")==["A"])
+    assert(tagger.get_level("new_tag")==0)
+    assert(not tagger.is_descendant("new_tag","tagABC"))
+    assert(3 not in tagger.get_levels())
+
+def match_uncompiled(tagger,reciever):
+    #Reference implementation which builds a regular expression for every tag on every call
+    r_text = remove_replacements(reciever)
+    matches = []
+    for tag in tagger._rec_cat:
+        reg_exp = remove_replacements("(?i)\\b("+"|".join(tagger._rec_cat[tag])+")\\b")
+        if tagger._rec_cat[tag] != [] and not re.search(reg_exp,r_text) is None:
+            matches.append(tag)
+            parent_tag = tagger._tag_parents.get(tag,None)
+            while parent_tag is not None:
+                matches.append(parent_tag)
+                parent_tag = tagger._tag_parents.get(parent_tag,None)
+    return matches
+
+texts = ["Kortköp 201227 A*2","Kortköp 201223 K*A3","B1 B2","b4","A2 B2","Lorem Ipsum","SWISH FRÅN Namn","Överföring C1",""]
+
+def test_match():
+    for path in [tag_path,tag_nested_path]:
+        tagger = Categorizer(path)
+        for text in texts:
+            assert(tagger.match(text)==match_uncompiled(tagger,text))
+
+def test_match__parents():
+    tagger = Categorizer(tag_nested_path)
+    assert(tagger.match("B1")==["B1","B","tagABC"])
+
+def test_match__append_remove():
+    tagger = Categorizer(tag_nested_path)
+    assert(tagger.match("Lorem Ipsum")==[])
+    tagger.append("A","Lorem")
+    assert(tagger.match("Lorem Ipsum")==["A","tagABC"])
+    tagger.append("new_tag","Ipsum",parent_tag="B")
+    assert(tagger.match("Lorem Ipsum")==["A","tagABC","new_tag","B","tagABC"])
+    tagger.remove("A","Lorem")
+    tagger.remove("new_tag")
+    assert(tagger.match("Lorem Ipsum")==[])
+
+def test_match__cache():
+    tagger = Categorizer(tag_nested_path)
+    first_match = tagger.match("Kortköp A*2")
+    #The same text after removing asterixes should be taken from the cache
+    assert(tagger.match("Kortköp A2")==first_match)
+    assert(tagger.match_cache_info().hits==1)
+    assert(tagger.match_cache_info().misses==1)
+    #Changing the returned list should not change the cache
+    first_match.append("changed")
+    assert(tagger.match("Kortköp A2")!=first_match)
+    #Changing the rules should clear the cache
+    tagger.append("new_tag","Kortköp")
+    assert("new_tag" in tagger.match("Kortköp A2"))
+
+def test_match_many():
+    tagger = Categorizer(tag_nested_path)
+    assert(tagger.match_many(texts)==[tagger.match(text) for text in texts])
+    #Duplicates should only be matched once
+    tagger = Categorizer(tag_nested_path)
+    tagger.match_many(["A1","A1","K*A1"])
+    assert(tagger.match_cache_info().currsize==1)
+
+def test_match_many__processes():
+    tagger = Categorizer(tag_nested_path)
+    many_texts = texts + ["Kortköp {i} A1".format(i=i) for i in range(50)]
+    assert(tagger.match_many(many_texts,processes=2,chunk_size=10)==[tagger.match(text) for text in many_texts])
+
+def test_match_many__cache_dir(tmp_path):
+    tagger = Categorizer(tag_nested_path,cache_dir=str(tmp_path))
+    matches = tagger.match_many(texts)
+    #Another tagger with the same rules should take every match from the saved file
+    tagger = Categorizer(tag_nested_path,cache_dir=str(tmp_path))
+    tagger._match = None
+    assert(tagger.match_many(texts)==matches)
+
+def test_match_many__cache_dir_changed_rules(tmp_path):
+    Categorizer(tag_nested_path,cache_dir=str(tmp_path)).match_many(texts)
+    tagger = Categorizer(tag_nested_path,cache_dir=str(tmp_path))
+    tagger.append("A","Lorem")
+    tagger.append("new_tag","B1",parent_tag="B")
+    #Only texts that the changed tags have or match are matched again
+    matched = []
+    match = tagger._match
+    tagger._match = lambda r_text: matched.append(r_text) or match(r_text)
+    reference = Categorizer(tag_nested_path)
+    reference.append("A","Lorem")
+    reference.append("new_tag","B1",parent_tag="B")
+    assert(tagger.match_many(texts)==reference.match_many(texts))
+    assert(sorted(matched)==sorted(["Kortköp 201227 A2","Kortköp 201223 A3","B1 B2","A2 B2","Lorem Ipsum"]))
+
+def test_match_many__unusable_cache_dir(tmp_path):
+    #If the cache directory can't be created, matching should work without the cache
+    file_path = tmp_path/"file"
+    file_path.write_text("")
+    tagger = Categorizer(tag_nested_path,cache_dir=str(file_path/"cache"))
+    assert(tagger.match_many(texts)==Categorizer(tag_nested_path).match_many(texts))
+    #Same if the directory disappears after the cache was created
+    cache_dir = tmp_path/"cache"
+    tagger = Categorizer(tag_nested_path,cache_dir=str(cache_dir))
+    tagger.match_many(texts[:2])
+    for path in cache_dir.iterdir():
+        path.unlink()
+    cache_dir.rmdir()
+    assert(tagger.match_many(texts)==Categorizer(tag_nested_path).match_many(texts))
+
+def test_compiled_cache(tmp_path):
+    cfile = str(tmp_path/"tags.json")
+    with open(tag_nested_path) as src, open(cfile,"w") as dst:
+        dst.write(src.read())
+    tagger = Categorizer(cfile,compiled_cache=True)
+    assert(os.path.exists(cfile+".compiled"))
+    with open(cfile+".compiled") as compiled_file:
+        assert(json.load(compiled_file)["rec_cat"]==[list(item) for item in tagger._rec_cat.items()])
+    compiled_tagger = Categorizer(cfile,compiled_cache=True)
+    #Patterns are only compiled when matching
+    assert(compiled_tagger._any_matcher is None and compiled_tagger._tag_patterns=={})
+    assert(compiled_tagger.match_many(texts)==tagger.match_many(texts))
+    assert(compiled_tagger.get_levels()==tagger.get_levels())
+    #Changing the json file should make the compiled rules outdated
+    tagger.append("new_tag","Lorem")
+    tagger.save(cfile)
+    assert(Categorizer(cfile,compiled_cache=True).match("Lorem Ipsum")==["new_tag"])
+    assert(Categorizer(cfile,compiled_cache=True).match("Lorem Ipsum")==["new_tag"])
+
 if __name__ == "__main__":
         test_get_tag_children()
\ No newline at end of file
@@ -0,0 +1,29 @@
+import math
+from array import array
+
+from homeplotter.calendarcube import CalendarCube
+
+dates = array('q', [10, 10, 12, 15])
+amounts = array('d', [0.1, 0.2, 5.0, -1.0])
+
+def test_total():
+    cube = CalendarCube(dates, amounts, range(4))
+    assert(cube.total(10, 15)==0.1+0.2+5.0-1.0)
+    assert(cube.total(11, 14)==5.0)
+    assert(cube.total(13, 14)==0)
+    #Ranges outside the dates are clipped
+    assert(cube.total(0, 100)==cube.total(10, 15))
+    assert(cube.total(15, 10)==0)
+
+def test_total__indices():
+    cube = CalendarCube(dates, amounts, [1, 3])
+    assert(cube.total(10, 15)==0.2-1.0)
+
+def test_total__rounding():
+    #Subtracting the cumulative sums should only give rounding errors far below a cent
+    cube = CalendarCube(dates, amounts, range(4))
+    assert(math.isclose(cube.total(12, 12), 5.0, abs_tol=1e-9))
+    assert(math.isclose(cube.total(10, 10), 0.1+0.2, abs_tol=1e-9))
+    big_amounts = array('d', [1e9, 0.01, 0.02, -1e9])
+    big_cube = CalendarCube(dates, big_amounts, range(4))
+    assert(math.isclose(big_cube.total(12, 15), 0.02-1e9, abs_tol=1e-5))
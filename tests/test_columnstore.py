@@ -0,0 +1,88 @@
+import datetime
+
+from homeplotter.columnstore import ColumnStore, bitmap_from_indices, bitmap_indices
+
+sample_rows = [
+    [datetime.date(2021, 1, 2), 100.0, "A1", ["tag1"], 100.0, "acc1"],
+    [datetime.date(2021, 1, 1), 50.0, "B1", [], 50.0, "acc2"],
+    [datetime.date(2021, 1, 2), 25.0, "A1", ["tag1"], 25.0, "acc1"],
+]
+
+def test_from_rows():
+    store = ColumnStore.from_rows(sample_rows)
+    assert(len(store)==3)
+    #Rows should come back the same as they went in
+    assert(store.rows()==sample_rows)
+
+def test_dictionary_encoding():
+    store = ColumnStore.from_rows(sample_rows)
+    #Repeated values should only be stored once
+    assert(store.texts==["A1","B1"])
+    assert(store.accounts==["acc1","acc2"])
+    assert(store.tagsets==[("tag1",),()])
+    assert(store.text_codes[0]==store.text_codes[2])
+
+def test_sort_dates():
+    store = ColumnStore.from_rows(sample_rows).sort_dates()
+    assert(store.get_date(0)==datetime.date(2021, 1, 1))
+    #Rows with the same date should keep their order
+    assert([row[1] for row in store.rows()]==[50.0,100.0,25.0])
+
+def test_concat():
+    store1 = ColumnStore.from_rows(sample_rows[:1])
+    store2 = ColumnStore.from_rows(sample_rows[1:])
+    store = store1.concat(store2)
+    assert(store.rows()==sample_rows)
+    #The original store should not be changed
+    assert(len(store1)==1)
+
+def test_retag():
+    store = ColumnStore.from_rows(sample_rows)
+    retagged = store.retagged(lambda texts: [[text.lower()] for text in texts])
+    assert(retagged.get_tags(0)==["a1"])
+    assert(retagged.get_tags(1)==["b1"])
+    #The original store should keep its tags
+    assert(store.get_tags(0)==["tag1"])
+
+def test_retag__text_codes():
+    store = ColumnStore.from_rows(sample_rows)
+    #Only text B1 (code 1) is matched again
+    retagged = store.retagged(lambda texts: [[text.lower()] for text in texts],[1])
+    assert([retagged.get_tags(i) for i in range(3)]==[["tag1"],["b1"],["tag1"]])
+    assert(store.text_tags(1)==())
+
+def test_scaled():
+    store = ColumnStore.from_rows(sample_rows)
+    scaled = store.scaled(2)
+    assert(list(scaled.amounts)==[50.0,25.0,12.5])
+    assert(list(store.amounts)==[100.0,50.0,25.0])
+    #Other columns are shared
+    assert(scaled.dates is store.dates)
+
+def test_bitmap_indices():
+    assert(bitmap_indices(0)==[])
+    assert(bitmap_indices(bitmap_from_indices([0,3,9],10))==[0,3,9])
+    assert(bitmap_indices(bitmap_from_indices(range(2,5),10))==[2,3,4])
+
+def test_tag_bitmap():
+    store = ColumnStore.from_rows(sample_rows)
+    assert(bitmap_indices(store.tag_bitmap("tag1"))==[0,2])
+    assert(store.tag_bitmap("missing")==0)
+    #Index should be rebuilt after retagging
+    store = store.retagged(lambda texts: [["tag1"] if text == "B1" else [] for text in texts])
+    assert(bitmap_indices(store.tag_bitmap("tag1"))==[1])
+
+def test_tagset_bitmap():
+    store = ColumnStore.from_rows(sample_rows)
+    assert(bitmap_indices(store.tagset_bitmap(lambda tags: len(tags)==0))==[1])
+
+def test_merge():
+    store1 = ColumnStore.from_rows(sample_rows).sort_dates()
+    store2 = ColumnStore.from_rows([[datetime.date(2021, 1, 1), 1.0, "C1", [], 1.0, "acc3"],[datetime.date(2021, 1, 3), 2.0, "C1", [], 2.0, "acc3"]])
+    store3 = ColumnStore.from_rows([[datetime.date(2020, 12, 31), 3.0, "D1", [], 3.0, "acc4"]])
+    merged = store1.merge(store2, store3)
+    #Merging should give the same result as concatenating and sorting
+    assert(merged.rows()==store1.concat(store2).concat(store3).sort_dates().rows())
+    assert([row[1] for row in merged.rows()]==[3.0,50.0,1.0,100.0,25.0,2.0])
+    #Concatenating several stores at once should be the same as one at a time
+    assert(store1.concat(store2, store3).rows()==store1.concat(store2).concat(store3).rows())
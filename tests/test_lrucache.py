@@ -0,0 +1,34 @@
+from homeplotter.lrucache import LRUCache
+
+def test_get_put():
+    cache = LRUCache(2)
+    assert(cache.get("a") is None)
+    cache.put("a",1)
+    assert(cache.get("a")==1)
+    assert(cache.info().hits==1)
+    assert(cache.info().misses==1)
+
+def test_evict_least_recently_used():
+    cache = LRUCache(2)
+    cache.put("a",1)
+    cache.put("b",2)
+    #Using "a" makes "b" the least recently used one
+    cache.get("a")
+    cache.put("c",3)
+    assert("a" in cache)
+    assert("b" not in cache)
+    assert(len(cache)==2)
+
+def test_clear():
+    cache = LRUCache(2)
+    cache.put("a",1)
+    cache.get("a")
+    cache.clear()
+    assert(len(cache)==0)
+    #Statistics are kept after clearing
+    assert(cache.info().hits==1)
+
+def test_maxsize_zero():
+    cache = LRUCache(0)
+    cache.put("a",1)
+    assert(len(cache)==0)
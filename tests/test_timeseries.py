@@ -33,6 +33,21 @@ def test_init__empty():
     ts = TimeSeries([])
     assert(ts.data==[])
 
+def test_init__unsorted():
+    #The order of the data shouldn't matter
+    ts = TimeSeries(sample_data)
+    ts_reversed = TimeSeries(sample_data[::-1])
+    assert(ts.data==ts_reversed.data)
+    assert(ts.timedelta==datetime.timedelta(1))
+
+def test_init__daterange():
+    ts = TimeSeries(sample_data,daterange=[datetime.date(2020, 12, 20),datetime.date(2021, 1, 5)])
+    assert(ts.data[0]==[datetime.date(2020, 12, 20),0])
+    assert(ts.data[-1]==[datetime.date(2021, 1, 5),0])
+    assert(len(ts.data)==17)
+    assert(ts.data[7]==[datetime.date(2020, 12, 27),0])
+    assert(ts.data[10]==[datetime.date(2020, 12, 30),600.0])
+
 def test_get_x():
     ts = TimeSeries(sample_data)
     x = ts.get_x()
@@ -52,17 +67,41 @@ def test_get_y():
 @pytest.mark.parametrize("padding", [False,True])
 def test_accumulate_twice(padding):
     #If you accumulate twice, it should be the same as delta1*delta2
-    #This is unimplemented
     ts1 = TimeSeries(sample_data)
     ts2 = TimeSeries(sample_data)
     ts1.accumulate(10,padding=padding)
     ts2.accumulate(2,padding=padding)
-    with pytest.raises(NotImplementedError):
-        ts2.accumulate(5,padding=padding)
+    ts2.accumulate(5,padding=padding)
 
-    # assert(len(ts1.data)==len(ts2.data))
-    # assert(ts1.get_x()==ts2.get_x())
-    # assert(ts1.get_y()==ts2.get_y())
+    assert(len(ts1.data)==len(ts2.data))
+    assert(ts1.get_x()==ts2.get_x())
+    assert(ts1.get_y()==ts2.get_y())
+
+@pytest.mark.parametrize("padding", [False,True])
+def test_accumulate__coarsen(padding):
+    #Weeks accumulated into two week buckets should be the same as accumulating two weeks directly
+    long_data = sample_data + [[datetime.date(2021, 1, 20), 10],[datetime.date(2021, 2, 3), 20]]
+    ts1 = TimeSeries(long_data)
+    ts2 = TimeSeries(long_data)
+    ts1.accumulate(2,"Week",padding=padding)
+    ts2.accumulate(1,"Week",padding=padding)
+    ts2.accumulate(2,"Week",padding=padding)
+    assert(ts1.data==ts2.data)
+
+def test_accumulate__month_delta():
+    data = [[datetime.date(2020, 1, 15), 1],[datetime.date(2020, 3, 1), 2],[datetime.date(2020, 5, 31), 4],[datetime.date(2020, 7, 31), 8]]
+    ts = TimeSeries(data)
+    ts.accumulate(3,"Month")
+    #February to July are complete months, January is incomplete
+    assert(ts.data==[[datetime.date(2020, 2, 1),2],[datetime.date(2020, 5, 1),12]])
+    ts = TimeSeries(data)
+    ts.accumulate(3,"Month",padding=True)
+    assert(ts.data==[[datetime.date(2019, 11, 1),1],[datetime.date(2020, 2, 1),2],[datetime.date(2020, 5, 1),12]])
+
+def test_accumulate__too_short():
+    ts = TimeSeries([[datetime.date(2020, 1, 5), 1],[datetime.date(2020, 1, 20), 2]])
+    with pytest.raises(ValueError):
+        ts.accumulate(1,"Month")
 
 def test_accumulate__empty():
     #It should be possible to initialize with an empty list
@@ -96,8 +135,54 @@ def test_moving_average__first_val():
     ts.moving_average(3)
     assert(ts.data[0][-1]==(200+50)/3)
 
+def test_moving_average__values():
+    #Every point is the average of the original values in its window, not of already averaged values
+    ts = TimeSeries(sample_data)
+    ts.moving_average(3)
+    expected = [(200+50)/3,50/3,0,0,0,600/3,(600-300)/3,(600-300)/3,(-300+100)/3]
+    assert(len(ts.data)==len(expected))
+    assert(all(math.isclose(point[1],value,abs_tol=1e-9) for (point,value) in zip(ts.data,expected)))
+
 def test_moving_average__empty():
     #It should be possible to initialize with an empty list
     ts = TimeSeries([])
     ts.moving_average(3)
-    assert(ts.data==[])
\ No newline at end of file
+    assert(ts.data==[])
+
+@pytest.mark.parametrize("window", [1,2,3,5])
+def test_rolling__simple(window):
+    ts = TimeSeries(sample_data)
+    original_data = [list(point) for point in ts.data]
+    rolled = ts.rolling(window)
+    #The original series should not be changed
+    assert(ts.data==original_data)
+    for (i,point) in enumerate(rolled.data):
+        assert(point[0]==original_data[i+window-1][0])
+        assert(math.isclose(point[1],sum([p[1] for p in original_data[i:i+window]])/window))
+
+def test_rolling__centered():
+    ts = TimeSeries(sample_data)
+    rolled = ts.rolling(3,"centered")
+    assert(len(rolled.data)==len(ts.data)-2)
+    assert(rolled.data[0]==[ts.data[1][0],(200+50)/3])
+
+def test_rolling__ewm():
+    ts = TimeSeries(sample_data)
+    rolled = ts.rolling(3,"ewm")
+    assert(len(rolled.data)==len(ts.data))
+    assert(rolled.data[0][1]==200)
+    assert(rolled.data[1][1]==0.5*50+0.5*200)
+
+def test_rolling__calendar():
+    ts = TimeSeries([[datetime.date(2021, 1, 1), 31],[datetime.date(2021, 2, 28), 28],[datetime.date(2021, 3, 31), 62]])
+    rolled = ts.rolling(1,"calendar","Month")
+    #The first point with a whole month before it is January 31st
+    assert(rolled.data[0]==[datetime.date(2021, 1, 31),1])
+    assert(rolled.data[-1]==[datetime.date(2021, 3, 31),2])
+    #The month before March 1st starts after February 1st, which is 28 days
+    assert(rolled.data[rolled.get_x().index(datetime.date(2021, 3, 1))][1]==1)
+
+def test_rolling__unknown_kind():
+    ts = TimeSeries(sample_data)
+    with pytest.raises(ValueError):
+        ts.rolling(3,"unknown")